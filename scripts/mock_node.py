@@ -8,7 +8,7 @@ Remnawave Node 模拟器 (HTTPS + mTLS)
 2. JWT Bearer Token 验证
 3. 接收 Worker 流量上报
 4. 响应 Remnawave 主机轮询
-5. 数据持久化（JSON 文件）
+5. 数据持久化（msgpack/JSON 快照 + 流量增量日志）
 
 使用方法：
     # 完整模式（mTLS + JWT）
@@ -35,34 +35,80 @@ SECRET_KEY 格式 (base64 编码的 JSON):
 import argparse
 import base64
 import gzip
+import hashlib
+import importlib.util
+import io
+import itertools
 import json
 import logging
 import ssl
+import sys
 import tempfile
 import threading
 import time
 import os
-from dataclasses import dataclass, field, asdict
+import zlib
+import queue
+import secrets
+import socket
+from array import array
+from collections import OrderedDict, defaultdict
 from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from typing import Optional
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Iterable, Iterator, Optional
 from urllib.parse import urlparse, parse_qs
 
-# 尝试导入 zstd 库（用于解压缩）
+# zstd、JWT 和 numpy 库导入较慢（JWT 验签会加载 cryptography/OpenSSL），
+# 启动时只检查是否安装，首次用到时再导入；--no-auth 等模式下不会付出导入开销
+
+# 检查 zstd 库（用于解压缩）
+HAS_ZSTD = importlib.util.find_spec('zstandard') is not None
+if not HAS_ZSTD:
+    print("提示: zstandard 未安装，zstd 压缩请求将无法处理。安装: pip install zstandard")
+
+# 检查 JWT 库（用于验证）
+HAS_JWT = importlib.util.find_spec('jwt') is not None
+if not HAS_JWT:
+    print("警告: PyJWT 未安装，JWT 验证将被跳过。安装: pip install PyJWT cryptography")
+
+# 尝试导入 orjson 库（可选，更快的 JSON 编解码，未安装时回退到标准库）
 try:
-    import zstandard as zstd
-    HAS_ZSTD = True
+    import orjson
+    HAS_ORJSON = True
 except ImportError:
-    HAS_ZSTD = False
-    print("提示: zstandard 未安装，zstd 压缩请求将无法处理。安装: pip install zstandard")
+    HAS_ORJSON = False
 
-# 尝试导入 JWT 库（用于验证）
+# 尝试导入 msgpack 库（可选，持久化文件使用更紧凑、更快的二进制格式）
 try:
-    import jwt
-    HAS_JWT = True
+    import msgpack
+    HAS_MSGPACK = True
 except ImportError:
-    HAS_JWT = False
-    print("警告: PyJWT 未安装，JWT 验证将被跳过。安装: pip install PyJWT cryptography")
+    HAS_MSGPACK = False
+
+# 检查 numpy 库（可选，用于向量化汇总用户流量列）
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+
+
+@lru_cache(maxsize=1)
+def zstd_module():
+    """首次调用时导入 zstandard"""
+    import zstandard
+    return zstandard
+
+
+@lru_cache(maxsize=1)
+def jwt_module():
+    """首次调用时导入 PyJWT"""
+    import jwt
+    return jwt
+
+
+@lru_cache(maxsize=1)
+def numpy_module():
+    """首次调用时导入 numpy"""
+    import numpy
+    return numpy
 
 # ============================================================================
 # 配置
@@ -76,17 +122,315 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-@dataclass
-class UserStats:
-    """用户流量统计
+def json_dumps(data, indent: bool = False) -> bytes:
+    """序列化为 UTF-8 编码的 JSON 字节（优先使用 orjson）"""
+    if HAS_ORJSON:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    # 紧凑分隔符，与 orjson 输出一致
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def json_loads(data: bytes):
+    """解析 JSON（接受 bytes，无需先解码为 str）"""
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# 用户流量列是 int64（array('q')），超出范围的值无法写入
+INT64_MIN, INT64_MAX = -(1 << 63), (1 << 63) - 1
+
+
+def parse_traffic(value) -> int:
+    """把上报的流量值转换为 int，超出 int64 范围时抛出 ValueError"""
+    value = int(value)
+    if not INT64_MIN <= value <= INT64_MAX:
+        raise ValueError(f"traffic value out of int64 range: {value}")
+    return value
+
+
+def column_sum(column: array) -> int:
+    """对 int64 列求和（有 numpy 时零拷贝映射为 ndarray 后向量化求和）"""
+    if HAS_NUMPY and len(column):
+        np = numpy_module()
+        return int(np.frombuffer(column, dtype=np.int64).sum())
+    return sum(column)
+
+
+def traffic_rows(uplinks: array, downlinks: array) -> list[int]:
+    """有流量（上行或下行大于 0）的行下标"""
+    if HAS_NUMPY and len(uplinks):
+        np = numpy_module()
+        mask = (np.frombuffer(uplinks, dtype=np.int64) > 0) | (np.frombuffer(downlinks, dtype=np.int64) > 0)
+        return np.flatnonzero(mask).tolist()
+    return [i for i, (up, down) in enumerate(zip(uplinks, downlinks)) if up > 0 or down > 0]
+
+
+def recent_mask(last_seen: array, since: float) -> list[bool]:
+    """每行的 last_seen 是否晚于 since（有 numpy 时对整列一次向量化比较）"""
+    if HAS_NUMPY and len(last_seen):
+        np = numpy_module()
+        return (np.frombuffer(last_seen, dtype=np.float64) > since).tolist()
+    return [seen > since for seen in last_seen]
+
+
+def new_tag_stats() -> dict:
+    """出入站统计的初始值"""
+    return {"uplink": 0, "downlink": 0}
+
+
+def pack_data(data: dict) -> bytes:
+    """序列化持久化数据（安装了 msgpack 时使用二进制格式，否则使用 JSON）"""
+    if HAS_MSGPACK:
+        return msgpack.packb(data, use_bin_type=True)
+    return json_dumps(data, indent=True)
+
+
+def unpack_data(raw: bytes) -> dict:
+    """解析持久化数据，按内容自动识别格式（兼容旧版 JSON 文件）"""
+    # JSON 文件以 '{' 或空白开头，msgpack 的 map 不会以这些字节开头
+    if raw[:1] in b'{ \t\r\n':
+        return json_loads(raw)
+    if not HAS_MSGPACK:
+        raise ValueError("数据文件为 msgpack 格式，但 msgpack 未安装。安装: pip install msgpack")
+    return msgpack.unpackb(raw, raw=False)
+
+
+def write_all(fd: int, data: bytes):
+    """用尽量少的 os.write 调用把 data 写入 fd（只在部分写入时重试）"""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def write_file(path: str, data: bytes):
+    """把 data 写入 path（覆盖）"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        write_all(fd, data)
+    finally:
+        os.close(fd)
+
+
+# JWT 验证缓存的容量和单个条目的最长缓存时间（秒）
+JWT_CACHE_MAX_SIZE = 10000
+JWT_CACHE_MAX_TTL = 60
+
+
+class JWTCache:
+    """验证成功的 JWT 缓存（LRU，线程安全）
     
-    注意：username 是 Remnawave 的 userId，不是 vless UUID
+    Remnawave 在 token 有效期内反复发送同一个 token，命中缓存可跳过 RSA 验签。
+    条目在 token 过期或缓存满 max_ttl 秒后失效（取较早者），
+    超出容量时淘汰最久未使用的条目。只缓存验证成功的 token。
     """
-    username: str         # Remnawave userId (不是 UUID!)
-    uplink: int = 0       # 上行流量（字节）
-    downlink: int = 0     # 下行流量（字节）
-    connections: int = 0  # 连接次数
-    last_seen: float = field(default_factory=time.time)
+    
+    def __init__(self, max_size: int = JWT_CACHE_MAX_SIZE, max_ttl: float = JWT_CACHE_MAX_TTL):
+        self._entries: OrderedDict[bytes, float] = OrderedDict()  # token 摘要 -> 失效时间
+        self._max_size = max_size
+        self._max_ttl = max_ttl
+        self._lock = threading.Lock()
+    
+    def hit(self, token_hash: bytes, now: float) -> bool:
+        """token 是否已验证且未失效；失效的条目在这里顺便清除"""
+        with self._lock:
+            expires_at = self._entries.get(token_hash)
+            if expires_at is None:
+                return False
+            if expires_at <= now:
+                del self._entries[token_hash]
+                return False
+            self._entries.move_to_end(token_hash)
+            return True
+    
+    def add(self, token_hash: bytes, exp: Optional[float], now: float):
+        """记录验证成功的 token，exp 为 token 的过期时间（没有则为 None）"""
+        expires_at = now + self._max_ttl
+        if exp:
+            expires_at = min(expires_at, exp)
+        with self._lock:
+            self._entries[token_hash] = expires_at
+            self._entries.move_to_end(token_hash)
+            if len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+
+_JWT_CACHE = JWTCache()
+# 会话：X-Session 会话 ID -> 失效时间。完整验签通过后签发，
+# 客户端之后带上会话 ID 即可跳过 JWT 解析，失效时间与对应的 token 缓存相同
+_SESSIONS = JWTCache()
+
+
+# zstd 压缩/解压上下文按线程复用：创建时会分配原生上下文和缓冲区，
+# 而 ZstdCompressor/ZstdDecompressor 不保证多线程并发调用安全
+_zstd_local = threading.local()
+
+# 响应压缩级别（低级别吞吐最高，对 JSON 的压缩率已经足够）
+ZSTD_RESPONSE_LEVEL = 1
+GZIP_RESPONSE_LEVEL = 1
+# 响应体达到该大小才压缩（太小的响应压缩收益抵不上开销）
+COMPRESS_MIN_SIZE = 512
+
+
+def get_zstd_decompressor() -> 'zstandard.ZstdDecompressor':
+    """获取当前线程的 zstd 解压器（首次调用时创建）"""
+    dctx = getattr(_zstd_local, 'dctx', None)
+    if dctx is None:
+        dctx = _zstd_local.dctx = zstd_module().ZstdDecompressor()
+    return dctx
+
+
+def get_zstd_compressor() -> 'zstandard.ZstdCompressor':
+    """获取当前线程的 zstd 压缩器（首次调用时创建）"""
+    cctx = getattr(_zstd_local, 'cctx', None)
+    if cctx is None:
+        cctx = _zstd_local.cctx = zstd_module().ZstdCompressor(level=ZSTD_RESPONSE_LEVEL)
+    return cctx
+
+
+def choose_response_encoding(accept_encoding: str) -> Optional[str]:
+    """根据 Accept-Encoding 选择响应压缩方式（优先 zstd，其次 gzip）"""
+    accepted = set()
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip())
+    
+    if 'zstd' in accepted and HAS_ZSTD:
+        return 'zstd'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress_response(body: bytes, encoding: str) -> bytes:
+    """按选定的编码压缩响应体"""
+    if encoding == 'zstd':
+        return get_zstd_compressor().compress(body)
+    return gzip.compress(body, compresslevel=GZIP_RESPONSE_LEVEL)
+
+
+def response_compressor(encoding: str):
+    """按选定的编码创建流式压缩对象（compress() 逐段压缩，flush() 结束）"""
+    if encoding == 'zstd':
+        return get_zstd_compressor().compressobj()
+    # wbits=31: 输出 gzip 格式（带头部和校验）
+    return zlib.compressobj(GZIP_RESPONSE_LEVEL, zlib.DEFLATED, 31)
+
+
+# 分块传输时每个 chunk 的目标大小（小片段先合并，避免大量很小的 write）
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+# 解压后请求体的大小上限（防止压缩炸弹撑爆内存）
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+# 预估的压缩比，用于预分配解压缓冲区
+DECOMPRESS_RATIO_HINT = 4
+# 流式解压时每次从请求体读取的大小
+READ_BUFFER_SIZE = 128 * 1024
+# 压缩格式的魔数（请求未声明 Content-Encoding 时用于识别）
+MAX_CHUNK_LINE = 64 * 1024  # 分块长度行/trailer 行的最大长度
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class RequestBody(io.RawIOBase):
+    """把 rfile 限制在 Content-Length 内的只读流
+    
+    keep-alive 连接上 rfile 之后紧跟着下一个请求，解压器不能越界读取
+    """
+    
+    def __init__(self, rfile, length: int):
+        self._rfile = rfile
+        self.remaining = length
+    
+    def readable(self) -> bool:
+        return True
+    
+    def readinto(self, b) -> int:
+        if self.remaining <= 0:
+            return 0
+        with memoryview(b) as view:
+            n = self._rfile.readinto(view[:self.remaining])
+        self.remaining -= n
+        return n
+    
+    def discard_rest(self):
+        """丢弃解压器没有读到的剩余字节，保持连接上的请求边界"""
+        while self.remaining > 0:
+            chunk = self._rfile.read(min(self.remaining, READ_BUFFER_SIZE))
+            if not chunk:
+                break
+            self.remaining -= len(chunk)
+
+
+def read_chunked_body(rfile) -> bytes:
+    """读取 Transfer-Encoding: chunked 的请求体（忽略分块扩展和 trailer）
+    
+    格式不正确时抛出 ValueError，调用方应关闭连接（请求边界已无法确定）
+    """
+    body = bytearray()
+    while True:
+        line = rfile.readline(MAX_CHUNK_LINE + 1)
+        if not line.endswith(b'\n'):
+            raise ValueError("分块长度行不完整")
+        size_field = line.split(b';', 1)[0].strip()
+        if not size_field or size_field.strip(b'0123456789abcdefABCDEF'):
+            raise ValueError(f"无效的分块长度: {size_field[:16]!r}")
+        size = int(size_field, 16)
+        if size == 0:
+            break
+        chunk = rfile.read(size)
+        if len(chunk) != size or rfile.readline(MAX_CHUNK_LINE + 1).strip():
+            raise ValueError("分块数据不完整")
+        body += chunk
+    # trailer 以空行结束
+    while True:
+        line = rfile.readline(MAX_CHUNK_LINE + 1)
+        if not line.strip():
+            return bytes(body)
+        if not line.endswith(b'\n'):
+            raise ValueError("分块 trailer 不完整")
+
+
+def decompress_body(source, encoding: str, compressed_size: int) -> bytearray:
+    """从 source 流式解压 zstd/gzip 数据（兼容未在帧头写入原始大小的 zstd 数据）"""
+    if encoding == 'zstd':
+        with get_zstd_decompressor().stream_reader(source, read_size=READ_BUFFER_SIZE) as reader:
+            return read_decompressed(reader, compressed_size)
+    with gzip.GzipFile(fileobj=source) as reader:
+        return read_decompressed(reader, compressed_size)
+
+
+def read_decompressed(reader, compressed_size: int) -> bytearray:
+    """从解压流中直接读入预分配的缓冲区
+
+    缓冲区按压缩前大小的估计值预分配，不足时翻倍扩容，
+    避免一次性解压产生的中间副本，并在超过上限时中止。
+    """
+    buf = bytearray(min(max(compressed_size * DECOMPRESS_RATIO_HINT, 4096), MAX_DECOMPRESSED_SIZE))
+    n = 0
+    while True:
+        if n == len(buf):
+            grow = min(n, MAX_DECOMPRESSED_SIZE + 1 - n)
+            if grow <= 0:
+                raise ValueError(f"解压后数据超过上限 {MAX_DECOMPRESSED_SIZE} 字节")
+            buf.extend(bytes(grow))
+        with memoryview(buf) as view:
+            read = reader.readinto(view[n:])
+        if not read:
+            break
+        n += read
+    del buf[n:]
+    return buf
 
 
 class UUIDMapping:
@@ -103,15 +447,19 @@ class UUIDMapping:
     
     def add_mapping(self, uuid: str, user_id: str):
         """添加 UUID -> userId 映射"""
-        uuid_lower = uuid.lower()
+        # 驻留规范化后的 UUID，查找时可以走指针相等的快速路径
+        uuid_lower = sys.intern(uuid.lower())
         with self._lock:
             self._uuid_to_user[uuid_lower] = user_id
             self._user_to_uuid[user_id] = uuid_lower
     
     def get_user_id(self, uuid: str) -> str:
-        """从 UUID 获取 userId，如果没有映射则返回 UUID 本身"""
+        """从 UUID 获取 userId，如果没有映射则返回 UUID 本身
+        
+        调用方需传入小写 UUID（在请求入口统一转换一次）
+        """
         with self._lock:
-            return self._uuid_to_user.get(uuid.lower(), uuid)
+            return self._uuid_to_user.get(uuid, uuid)
     
     def get_uuid(self, user_id: str) -> Optional[str]:
         """从 userId 获取 UUID"""
@@ -132,6 +480,122 @@ class UUIDMapping:
             return dict(self._uuid_to_user)
 
 
+# 增量日志中的重置记录
+RESET_USERS_RECORD = b'{"reset":"users"}'
+RESET_TAGS_RECORD = b'{"reset":"tags"}'
+
+
+class TrafficLog:
+    """流量增量日志（只追加写，每行一条 JSON 记录）
+    
+    每批上报和每次重置追加一行，写入量只与这次修改有关，不随用户数增长。
+    文件名为 <data_file>.log.<seq>：每次写完整快照时换用下一个序号，快照中记录
+    log_seq，加载时回放序号不小于 log_seq 的日志；快照写入成功后才删除更早的日志，
+    因此在任何时刻崩溃都不会丢失或重复计入流量。
+    """
+    
+    def __init__(self, data_file: str):
+        self._dir = os.path.dirname(os.path.abspath(data_file))
+        self._prefix = os.path.basename(data_file) + '.log.'
+        self._fd: Optional[int] = None
+        self.seq = 0
+        self.size = 0  # 当前日志文件的字节数
+    
+    def path(self, seq: int) -> str:
+        return os.path.join(self._dir, f"{self._prefix}{seq}")
+    
+    def existing(self) -> list[tuple[int, str]]:
+        """磁盘上已有的日志 [(seq, path)]，按序号升序"""
+        logs = []
+        try:
+            names = os.listdir(self._dir)
+        except FileNotFoundError:
+            return logs
+        for name in names:
+            if name.startswith(self._prefix) and name[len(self._prefix):].isdigit():
+                logs.append((int(name[len(self._prefix):]), os.path.join(self._dir, name)))
+        return sorted(logs)
+    
+    def open(self, seq: int):
+        """切换到序号为 seq 的日志（追加写），之后的记录都写入这个文件"""
+        fd = os.open(self.path(seq), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = fd
+        self.seq = seq
+        self.size = os.fstat(fd).st_size
+    
+    def append(self, record: bytes):
+        """追加一条已序列化的记录（一次 os.write）"""
+        if self._fd is None:
+            raise OSError("增量日志未打开")
+        line = record + b'\n'
+        write_all(self._fd, line)
+        self.size += len(line)
+    
+    def remove_before(self, seq: int):
+        """删除序号小于 seq 的日志（已经包含在快照中）"""
+        for old_seq, path in self.existing():
+            if old_seq < seq:
+                os.unlink(path)
+    
+    @staticmethod
+    def read_records(path: str) -> Iterator[dict]:
+        """逐条读取日志记录，跳过无法解析的行（例如崩溃时写了一半的最后一行）"""
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    yield json_loads(line)
+                except ValueError:
+                    logger.warning(f"跳过无法解析的增量日志记录: {path}")
+
+
+class UserShard:
+    """用户统计的一个分片：按列存储（SoA）并带独立的锁
+    
+    每个字段一个连续数组，按用户下标访问，汇总/重置只需扫描连续内存。
+    不同分片的用户可以被并发修改和读取，互不阻塞。
+    
+    注意：username 是 Remnawave 的 userId，不是 vless UUID
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index: dict[str, int] = {}  # username -> 下标
+        self.names: list[str] = []
+        self.uplinks = array('q')
+        self.downlinks = array('q')
+        self.connections = array('q')
+        self.last_seen = array('d')
+    
+    def add(self, username: str) -> int:
+        """追加新用户的一行（调用方需持有 self.lock），返回下标"""
+        i = len(self.names)
+        self.index[username] = i
+        self.names.append(username)
+        self.uplinks.append(0)
+        self.downlinks.append(0)
+        self.connections.append(0)
+        self.last_seen.append(time.time())
+        return i
+    
+    def take_traffic(self) -> tuple[array, array]:
+        """取出上下行流量列并换成全零列（调用方需持有 self.lock）
+        
+        返回的旧列不再被其他线程修改，可以在锁外读取
+        """
+        uplinks, downlinks = self.uplinks, self.downlinks
+        zeros = bytes(uplinks.itemsize * len(uplinks))
+        self.uplinks = array('q', zeros)
+        self.downlinks = array('q', zeros)
+        return uplinks, downlinks
+    
+    def snapshot(self) -> tuple:
+        """复制所有列（调用方需持有 self.lock），每列都是整块内存拷贝"""
+        return (self.names[:], self.uplinks[:], self.downlinks[:],
+                self.connections[:], self.last_seen[:])
+
+
 class StatsStore:
     """流量统计存储（线程安全，支持持久化）
     
@@ -144,15 +608,51 @@ class StatsStore:
     DEFAULT_INBOUND_TAG = "VLESS_WS"
     DEFAULT_OUTBOUND_TAG = "DIRECT"
     
+    # 用户统计分片数（2 的幂，按 hash(username) 取低位选择分片）
+    USER_SHARDS = 16
+    # 最近多少秒内有上报视为在线
+    ONLINE_WINDOW = 300
+    
     def __init__(self, data_file: Optional[str] = None):
-        self._stats: dict[str, UserStats] = {}
+        # 用户统计按 username 分片，每个分片有独立的锁
+        self._shards = [UserShard() for _ in range(self.USER_SHARDS)]
+        # 出入站统计、当前标签和保存计数共用这把锁（标签通常只有一两个）
         self._lock = threading.Lock()
         self._start_time = time.time()
         self._uuid_mapping = UUIDMapping()
         self._data_file = data_file or "stats_data.json"
-        self._save_interval = 60  # 每 60 秒自动保存
+        self._save_interval = 60  # 每 60 秒检查一次是否需要保存
+        # 未写入增量日志的修改（xrayConfig 标签、日志写入失败时的上报等）累计达到该次数时保存；
+        # 正常写入日志的流量上报不计入，由日志大小和最长延迟触发保存
+        self._save_min_updates = 256
+        self._save_max_delay = 300  # 更新较少时，最多延迟这么久（秒）也会保存
+        self._save_log_size = 4 * 1024 * 1024  # 增量日志达到该大小时写完整快照
         self._last_save = time.time()
-        self._dirty = False  # 标记是否有未保存的更改
+        self._dirty_count = 0  # 上次保存以来未写入增量日志的更新次数
+        self._save_lock = threading.Lock()  # 串行化保存，避免同时写临时文件
+        
+        # 流量增量日志：上报和重置先追加到日志，完整快照只在日志变大或定期写入
+        self._log = TrafficLog(self._data_file)
+        # 写日志的修改（上报批次、重置）和日志切换共用这把锁，保证日志顺序与修改顺序一致
+        self._log_lock = threading.Lock()
+        # 所有用户/出入站流量累计绝对值的上界（只在 _log_lock 下修改），
+        # 上界加上本批增量不超出 int64 时无需逐条检查溢出
+        self._traffic_bound = 0
+        
+        # 上报队列：report() 只入队，由单个消费线程批量写入，减少锁竞争
+        self._report_queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._drain_lock = threading.Lock()  # 同一时刻只有一个线程在写入批次
+        self._report_event = threading.Event()  # 有新上报时唤醒消费线程
+        
+        # 轮询响应缓存：(数据版本, 响应体)。统计每次变化后都会取一个新的版本号，
+        # 版本一致时可以直接复用已序列化的响应
+        self._version_counter = itertools.count(1)
+        self._users_version = 0
+        self._tags_version = 0
+        self._users_body_cache: Optional[tuple[int, bytes]] = None
+        self._combined_body_cache: Optional[tuple[int, bytes]] = None
+        # 用户流量合计缓存：(数据版本, (上行, 下行))，四个合计接口共用
+        self._totals_cache: Optional[tuple[int, tuple[int, int]]] = None
         
         # 当前使用的出入站 tag（从 xrayConfig 获取）
         self._current_inbound_tag = self.DEFAULT_INBOUND_TAG
@@ -164,96 +664,250 @@ class StatsStore:
         
         # 出入站统计（独立于用户统计）
         # 格式: { tag: { "uplink": int, "downlink": int } }
-        self._inbound_stats: dict[str, dict] = {}
-        self._outbound_stats: dict[str, dict] = {}
+        self._inbound_stats: defaultdict[str, dict] = defaultdict(new_tag_stats)
+        self._outbound_stats: defaultdict[str, dict] = defaultdict(new_tag_stats)
         
         # 加载持久化数据
         self._load_data()
         
-        # 启动自动保存线程
+        # 启动上报消费线程和自动保存线程
+        self._start_report_consumer()
         self._start_auto_save()
     
     def _load_data(self):
-        """从文件加载数据"""
-        if not os.path.exists(self._data_file):
+        """从快照文件加载数据，再回放快照之后的增量日志"""
+        log_seq = 0
+        if os.path.exists(self._data_file):
+            log_seq = self._load_snapshot()
+        else:
             logger.info(f"数据文件不存在，将创建: {self._data_file}")
-            return
+        self._replay_log(log_seq)
+        self._traffic_bound = self._exact_traffic_bound()
+    
+    def _load_snapshot(self) -> int:
+        """加载完整快照，返回快照对应的日志序号
         
+        快照无法读取时抛出 RuntimeError：继续运行的话，下一次保存会用空数据覆盖快照，
+        并删除它之后的增量日志，原有统计就永久丢失了
+        """
         try:
-            with open(self._data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            with open(self._data_file, 'rb') as f:
+                data = unpack_data(f.read())
             
             # 恢复用户统计
             for user_data in data.get('users', []):
-                user = UserStats(
-                    username=user_data['username'],
-                    uplink=user_data.get('uplink', 0),
-                    downlink=user_data.get('downlink', 0),
-                    connections=user_data.get('connections', 0),
-                    last_seen=user_data.get('last_seen', time.time())
-                )
-                self._stats[user.username] = user
+                shard = self._shard_for(user_data['username'])
+                i = shard.add(user_data['username'])
+                shard.uplinks[i] = user_data.get('uplink', 0)
+                shard.downlinks[i] = user_data.get('downlink', 0)
+                shard.connections[i] = user_data.get('connections', 0)
+                shard.last_seen[i] = user_data.get('last_seen', time.time())
             
             # 恢复 UUID 映射（旧版兼容）
             for uuid, user_id in data.get('mappings', {}).items():
                 self._uuid_mapping.add_mapping(uuid, user_id)
             
             # 恢复 uuid -> email 映射
-            self._uuid_to_email = data.get('uuid_to_email', {})
+            self._uuid_to_email = {
+                sys.intern(uuid.lower()): email
+                for uuid, email in data.get('uuid_to_email', {}).items()
+            }
             
             # 恢复出入站统计
-            self._inbound_stats = data.get('inbound_stats', {})
-            self._outbound_stats = data.get('outbound_stats', {})
+            self._inbound_stats = defaultdict(new_tag_stats, data.get('inbound_stats', {}))
+            self._outbound_stats = defaultdict(new_tag_stats, data.get('outbound_stats', {}))
             
             # 恢复标签设置
             self._current_inbound_tag = data.get('current_inbound_tag', self.DEFAULT_INBOUND_TAG)
             self._current_outbound_tag = data.get('current_outbound_tag', self.DEFAULT_OUTBOUND_TAG)
             
-            logger.info(f"已加载 {len(self._stats)} 个用户统计, {len(self._uuid_to_email)} 个 uuid->email 映射")
+            logger.info(f"已加载 {self.user_count} 个用户统计, {len(self._uuid_to_email)} 个 uuid->email 映射")
+            return data.get('log_seq', 0)
         except Exception as e:
-            logger.error(f"加载数据失败: {e}")
+            raise RuntimeError(f"加载数据失败: {e}（为避免覆盖 {self._data_file}，"
+                               f"请修复该文件或将其移走后再启动）") from e
+    
+    def _replay_log(self, log_seq: int):
+        """回放序号不小于 log_seq 的增量日志，然后打开日志供之后追加"""
+        logs = self._log.existing()
+        replayed = 0
+        for seq, path in logs:
+            if seq < log_seq:
+                continue
+            for record in TrafficLog.read_records(path):
+                self._replay_record(record)
+                replayed += 1
+        
+        # 最新的日志为空时继续使用，否则换用新序号（不在可能写了一半的行后面追加）
+        if logs and logs[-1][0] >= log_seq and os.path.getsize(logs[-1][1]) == 0:
+            seq = logs[-1][0]
+        else:
+            seq = max(log_seq, logs[-1][0] + 1 if logs else 0)
+        try:
+            self._log.open(seq)
+            self._log.remove_before(log_seq)
+        except OSError as e:
+            # 例如数据目录不存在：上报仍然记入内存，改为等待完整快照保存
+            logger.error(f"打开增量日志失败: {e}")
+        
+        if replayed:
+            self._dirty_count += 1  # 回放的数据还没有写入快照
+            logger.info(f"已回放 {replayed} 条增量日志记录")
+    
+    def _replay_record(self, record: dict):
+        """把一条增量日志记录应用到内存中的统计"""
+        reset = record.get('reset')
+        if reset == 'users':
+            self._gather_user_traffic(reset=True)
+        elif reset == 'tags':
+            self._take_tag_stats(reset=True)
+        else:
+            self._apply_deltas(
+                {row[0]: row[1:] for row in record.get('users', [])},
+                {row[0]: row[1:] for row in record.get('inbounds', [])},
+                {row[0]: row[1:] for row in record.get('outbounds', [])},
+            )
+    
+    def _log_append(self, record: bytes):
+        """追加一条增量日志（调用方需持有 _log_lock），失败时改为等待完整快照保存"""
+        try:
+            self._log.append(record)
+        except OSError as e:
+            logger.error(f"写入增量日志失败: {e}")
+            with self._lock:
+                self._dirty_count += 1
     
     def _save_data(self):
         """保存数据到文件"""
+        with self._save_lock:
+            self._save_data_locked()
+    
+    def _save_data_locked(self):
+        self._flush_reports()
+        dirty_count = 0
         try:
-            with self._lock:
-                data = {
-                    'users': [
-                        {
-                            'username': u.username,
-                            'uplink': u.uplink,
-                            'downlink': u.downlink,
-                            'connections': u.connections,
-                            'last_seen': u.last_seen,
-                        }
-                        for u in self._stats.values()
-                    ],
-                    'mappings': self._uuid_mapping.get_all_mappings(),
-                    'uuid_to_email': self._uuid_to_email,
-                    'inbound_stats': self._inbound_stats,
-                    'outbound_stats': self._outbound_stats,
-                    'current_inbound_tag': self._current_inbound_tag,
-                    'current_outbound_tag': self._current_outbound_tag,
-                    'saved_at': datetime.now().isoformat(),
-                }
+            with self._log_lock:
+                with self._lock:
+                    # 在锁内清零计数，避免快照之后的上报被误标为已保存
+                    dirty_count, self._dirty_count = self._dirty_count, 0
+                    inbound_stats, outbound_stats = self._snapshot_tag_stats()
+                    uuid_to_email = dict(self._uuid_to_email)
+                    inbound_tag = self._current_inbound_tag
+                    outbound_tag = self._current_outbound_tag
+                
+                columns = self._snapshot_user_columns()
+                
+                # 之后的修改写入下一个日志；这份快照包含之前所有日志中的修改
+                log_seq = self._log.seq + 1
+                self._log.open(log_seq)
+            
+            # 在锁外构建数据，不阻塞并发的上报
+            data = {
+                'users': [
+                    {'username': name, 'uplink': up, 'downlink': down,
+                     'connections': conns, 'last_seen': seen}
+                    for name, up, down, conns, seen in zip(*columns)
+                ],
+                'mappings': self._uuid_mapping.get_all_mappings(),
+                'uuid_to_email': uuid_to_email,
+                'inbound_stats': inbound_stats,
+                'outbound_stats': outbound_stats,
+                'current_inbound_tag': inbound_tag,
+                'current_outbound_tag': outbound_tag,
+                'log_seq': log_seq,
+                'saved_at': datetime.now().isoformat(),
+            }
             
             # 写入临时文件后重命名（原子操作）
+            # 数据已整体序列化，直接用 os.write 写出，不经过文件对象缓冲；
+            # 模拟节点的统计数据不要求落盘持久，因此不做 fsync
             temp_file = self._data_file + '.tmp'
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            write_file(temp_file, pack_data(data))
             os.replace(temp_file, self._data_file)
+            self._log.remove_before(log_seq)
             
-            self._dirty = False
-            logger.debug(f"数据已保存到 {self._data_file}")
+            self._last_save = time.time()
+            logger.debug(f"数据已保存到 {self._data_file}（{dirty_count} 次更新）")
         except Exception as e:
+            # 保存失败，保留计数以便下次重试
+            with self._lock:
+                self._dirty_count += dirty_count
             logger.error(f"保存数据失败: {e}")
     
+    def _should_save(self) -> bool:
+        """是否需要写完整快照：增量日志足够大、未记入日志的更新足够多，
+        或有任何更新且距上次保存已足够久"""
+        if self._log.size >= self._save_log_size or self._dirty_count >= self._save_min_updates:
+            return True
+        return ((self._dirty_count > 0 or self._log.size > 0)
+                and time.time() - self._last_save >= self._save_max_delay)
+    
+    def _shard_for(self, username: str) -> UserShard:
+        """username 所在的分片"""
+        return self._shards[hash(username) & (self.USER_SHARDS - 1)]
+    
+    def _snapshot_user_columns(self) -> tuple:
+        """依次锁住每个分片复制列，再拼接成整体的列快照
+        
+        各分片的快照时间点略有先后，对监控统计来说可以接受
+        """
+        names, uplinks, downlinks = [], array('q'), array('q')
+        connections, last_seen = array('q'), array('d')
+        for shard in self._shards:
+            with shard.lock:
+                columns = shard.snapshot()
+            names += columns[0]
+            uplinks += columns[1]
+            downlinks += columns[2]
+            connections += columns[3]
+            last_seen += columns[4]
+        return names, uplinks, downlinks, connections, last_seen
+    
+    def _collect_user_traffic(self, reset: bool) -> tuple[list[str], array, array, int]:
+        """收集所有用户的上下行流量列，reset=True 时同时清零
+        
+        Returns:
+            (names, uplinks, downlinks, version)，version 为收集前的用户数据版本
+        """
+        version = self._users_version
+        if reset:
+            # 清零和写日志在同一把锁内，日志中的重置与上报保持实际发生的顺序
+            with self._log_lock:
+                names, uplinks, downlinks = self._gather_user_traffic(reset=True)
+                self._log_append(RESET_USERS_RECORD)
+            self._users_version = next(self._version_counter)
+        else:
+            names, uplinks, downlinks = self._gather_user_traffic(reset=False)
+        return names, uplinks, downlinks, version
+    
+    def _gather_user_traffic(self, reset: bool) -> tuple[list[str], array, array]:
+        """依次锁住每个分片复制（reset=True 时取出并清零）上下行流量列"""
+        names, uplinks, downlinks = [], array('q'), array('q')
+        for shard in self._shards:
+            with shard.lock:
+                shard_names = shard.names[:]
+                if reset:
+                    shard_up, shard_down = shard.take_traffic()
+                else:
+                    shard_up, shard_down = shard.uplinks[:], shard.downlinks[:]
+            names += shard_names
+            uplinks += shard_up
+            downlinks += shard_down
+        return names, uplinks, downlinks
+    
+    def _snapshot_tag_stats(self) -> tuple[dict, dict]:
+        """复制出入站统计（调用方需持有 self._lock）"""
+        return (
+            {tag: dict(stats) for tag, stats in self._inbound_stats.items()},
+            {tag: dict(stats) for tag, stats in self._outbound_stats.items()},
+        )
+    
     def _start_auto_save(self):
         """启动自动保存线程"""
         def auto_save_loop():
             while True:
                 time.sleep(self._save_interval)
-                if self._dirty:
+                if self._should_save():
                     self._save_data()
         
         thread = threading.Thread(target=auto_save_loop, daemon=True)
@@ -271,115 +925,433 @@ class StatsStore:
                 inbound_tag: str = None, outbound_tag: str = None):
         """上报用户流量
         
+        上报先进入队列，由后台线程批量写入；读取统计前会先写入队列中剩余的上报，
+        因此调用返回后的任何查询都能看到这次上报。
+        
         Args:
-            identifier: 用户标识（UUID，会自动转换为 email）
+            identifier: 用户标识（小写 UUID，会自动转换为 email）
             uplink: 上行流量（字节）
             downlink: 下行流量（字节）
             inbound_tag: 入站 tag（用于出入站统计，默认使用 xrayConfig 中的）
             outbound_tag: 出站 tag（用于出入站统计，默认使用 xrayConfig 中的）
+        
+        Returns:
+            实际记账使用的用户标识（email 或 UUID）
         """
         # 将 UUID 转换为 email（Xray 使用 email 作为流量统计标识）
         username = self.get_email_by_uuid(identifier)
         
+        # 零流量的心跳只刷新已知用户的最后活跃时间，不入队、不计为待保存的更新
+        if uplink == 0 and downlink == 0 and self._touch(username):
+            return username
+        
         # 使用 xrayConfig 设置的标签或默认值
         inbound_tag = inbound_tag or self._current_inbound_tag
         outbound_tag = outbound_tag or self._current_outbound_tag
         
-        with self._lock:
-            # 更新用户统计
-            if username not in self._stats:
-                self._stats[username] = UserStats(username=username)
-            
-            user = self._stats[username]
-            user.uplink += uplink
-            user.downlink += downlink
-            user.connections += 1
-            user.last_seen = time.time()
-            
-            # 更新出入站统计（与用户统计独立）
+        # 只入队，不抢 self._lock；由后台线程批量写入
+        self._report_queue.put((username, uplink, downlink, inbound_tag, outbound_tag, time.time()))
+        self._report_event.set()
+        return username
+    
+    def report_batch(self, items: list[tuple]) -> int:
+        """批量上报用户流量，一次写入整批（连同队列中已有的上报）
+        
+        Args:
+            items: [(identifier, uplink, downlink, inbound_tag, outbound_tag), ...]，
+                   各字段含义同 report()，tag 可以为 None
+        
+        Returns:
+            处理的条数
+        """
+        default_inbound = self._current_inbound_tag
+        default_outbound = self._current_outbound_tag
+        now = time.time()
+        get_email = self._uuid_to_email.get
+        
+        batch = []
+        for identifier, uplink, downlink, inbound_tag, outbound_tag in items:
+            username = get_email(identifier, identifier)
+            # 与 report() 一致：已知用户的零流量心跳只刷新 last_seen
+            if uplink == 0 and downlink == 0 and self._touch(username):
+                continue
+            batch.append((username, uplink, downlink,
+                          inbound_tag or default_inbound, outbound_tag or default_outbound, now))
+        
+        if batch:
+            # 直接写入，不经过队列；队列中更早的上报一起写入，读取时依然可见
+            with self._drain_lock:
+                self._apply_reports_isolated(self._drain_queue(batch))
+        return len(items)
+    
+    def _touch(self, username: str) -> bool:
+        """刷新已知用户的 last_seen，用户不存在时返回 False"""
+        shard = self._shard_for(username)
+        with shard.lock:
+            i = shard.index.get(username)
+            if i is None:
+                return False
+            shard.last_seen[i] = max(shard.last_seen[i], time.time())
+            return True
+    
+    def _start_report_consumer(self):
+        """启动上报消费线程：等待新上报，取空后整批写入
+        
+        只在持有 _drain_lock 时出队，避免 _flush_reports() 返回时
+        还有已出队但未写入的上报
+        """
+        def consume_loop():
+            while True:
+                self._report_event.wait()
+                self._report_event.clear()
+                try:
+                    self._flush_reports()
+                except Exception:
+                    # 不能让消费线程退出，否则之后的上报只能等读取统计时才写入
+                    logger.exception("写入上报失败")
+        
+        thread = threading.Thread(target=consume_loop, daemon=True)
+        thread.start()
+    
+    def _drain_queue(self, batch: list) -> list:
+        """把队列中当前已有的上报全部取出，追加到 batch"""
+        try:
+            while True:
+                batch.append(self._report_queue.get_nowait())
+        except queue.Empty:
+            return batch
+    
+    def _flush_reports(self):
+        """读取统计前调用：确保此前入队的上报都已写入
+        
+        持有 _drain_lock 期间消费线程不会持有未写入的批次，
+        因此返回后所有先前的 report() 调用都已可见。
+        """
+        with self._drain_lock:
+            batch = self._drain_queue([])
+            if batch:
+                self._apply_reports_isolated(batch)
+    
+    def _apply_reports_isolated(self, batch: list):
+        """整批写入失败时逐条重试，只丢弃自身无法写入的上报（调用方需持有 _drain_lock）
+        
+        _apply_reports 只会在修改统计之前失败（聚合或序列化），重试不会重复计数
+        """
+        try:
+            self._apply_reports(batch)
+        except Exception as e:
+            logger.error(f"批量写入上报失败，逐条重试: {e}")
+            for item in batch:
+                try:
+                    self._apply_reports([item])
+                except Exception as e:
+                    logger.error(f"丢弃无法写入的上报 {item[0]}: {e}")
+    
+    @staticmethod
+    def _aggregate_reports(batch: list) -> tuple[dict, dict, dict]:
+        """按用户/标签聚合一批上报，返回 (users, inbounds, outbounds)（格式见 _apply_deltas）"""
+        users = defaultdict(lambda: [0, 0, 0, 0.0])  # username -> [上行, 下行, 次数, 最后时间]
+        inbounds = defaultdict(lambda: [0, 0])
+        outbounds = defaultdict(lambda: [0, 0])
+        for username, uplink, downlink, inbound_tag, outbound_tag, ts in batch:
+            user = users[username]
+            user[0] += uplink
+            user[1] += downlink
+            user[2] += 1
+            user[3] = max(user[3], ts)
             # 入站: 接收客户端数据 = uplink
-            if inbound_tag not in self._inbound_stats:
-                self._inbound_stats[inbound_tag] = {"uplink": 0, "downlink": 0}
-            self._inbound_stats[inbound_tag]["uplink"] += uplink
-            self._inbound_stats[inbound_tag]["downlink"] += downlink
-            
+            inbound = inbounds[inbound_tag]
+            inbound[0] += uplink
+            inbound[1] += downlink
             # 出站: 发送到远程 = downlink（从服务器角度）
-            if outbound_tag not in self._outbound_stats:
-                self._outbound_stats[outbound_tag] = {"uplink": 0, "downlink": 0}
-            self._outbound_stats[outbound_tag]["uplink"] += uplink
-            self._outbound_stats[outbound_tag]["downlink"] += downlink
-            
-            self._dirty = True  # 标记需要保存
-            
-            logger.info(f"流量上报: {username} ↑{uplink} ↓{downlink} (累计 ↑{user.uplink} ↓{user.downlink})")
+            outbound = outbounds[outbound_tag]
+            outbound[0] += uplink
+            outbound[1] += downlink
+        return users, inbounds, outbounds
+    
+    @staticmethod
+    def _delta_record(users: dict, inbounds: dict, outbounds: dict) -> bytes:
+        """把聚合后的增量序列化为一条增量日志记录（每行 [名称, 上行, 下行, ...]）"""
+        return json_dumps({
+            "users": [[username, *deltas] for username, deltas in users.items()],
+            "inbounds": [[tag, *deltas] for tag, deltas in inbounds.items()],
+            "outbounds": [[tag, *deltas] for tag, deltas in outbounds.items()],
+        })
+    
+    @staticmethod
+    def _delta_peak(*deltas: dict) -> int:
+        """聚合增量中上下行绝对值的最大值"""
+        return max((abs(value) for group in deltas for row in group.values() for value in row[:2]),
+                   default=0)
     
-    def get_users_stats(self, reset: bool = False) -> list[dict]:
-        """获取所有用户流量统计（remnawave 格式）"""
+    def _apply_reports(self, batch: list):
+        """把一批上报先在本地按用户/标签聚合，再在一次加锁中写入（调用方需持有 _drain_lock）"""
+        users, inbounds, outbounds = self._aggregate_reports(batch)
+        peak = self._delta_peak(users, inbounds, outbounds)
+        
+        # 序列化在锁外完成；写入内存和追加日志在同一把锁内
+        record = self._delta_record(users, inbounds, outbounds)
+        with self._log_lock:
+            if self._traffic_bound + peak > INT64_MAX:
+                # 可能溢出（极少见）：按当前累计值逐条检查，丢弃会溢出的上报后重新聚合
+                self._traffic_bound = self._exact_traffic_bound()
+                if self._traffic_bound + peak > INT64_MAX:
+                    batch = self._reports_in_range(batch)
+                    users, inbounds, outbounds = self._aggregate_reports(batch)
+                    peak = self._delta_peak(users, inbounds, outbounds)
+                    record = self._delta_record(users, inbounds, outbounds)
+            self._traffic_bound += peak
+            totals = self._apply_deltas(users, inbounds, outbounds)
+            if batch:
+                self._log_append(record)
+        
+        # 每个用户一行日志，便于按行检索；未启用 INFO 时整批跳过格式化
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        for username, uplink, downlink, total_up, total_down in totals:
+            logger.info(f"流量上报: {username} ↑{uplink} ↓{downlink} (累计 ↑{total_up} ↓{total_down})")
+    
+    def _exact_traffic_bound(self) -> int:
+        """扫描当前所有用户/出入站累计值，返回绝对值的最大值（调用方需持有 _log_lock 或在加载阶段）"""
+        bound = 0
+        for shard in self._shards:
+            with shard.lock:
+                for column in (shard.uplinks, shard.downlinks):
+                    if len(column):
+                        bound = max(bound, max(column), -min(column))
         with self._lock:
-            result = []
-            for user in self._stats.values():
-                # 只返回有流量的用户
-                if user.uplink > 0 or user.downlink > 0:
-                    result.append({
-                        "username": user.username,
-                        "uplink": user.uplink,
-                        "downlink": user.downlink,
-                    })
-            
-            if reset:
-                # 重置用户统计（不影响出入站统计）
-                for user in self._stats.values():
-                    user.uplink = 0
-                    user.downlink = 0
-                logger.info(f"用户流量统计已重置，返回 {len(result)} 条记录")
+            for tag_stats in (self._inbound_stats, self._outbound_stats):
+                for stats in tag_stats.values():
+                    bound = max(bound, abs(stats["uplink"]), abs(stats["downlink"]))
+        return bound
+    
+    def _reports_in_range(self, batch: list) -> list:
+        """按顺序检查每条上报，丢弃会使用户或出入站累计值超出 int64 的上报（调用方需持有 _log_lock）
+        
+        持有 _log_lock 时累计值只会被当前线程修改，可以先读出再逐条累加判断
+        """
+        def user_base(username: str) -> tuple[int, int]:
+            shard = self._shard_for(username)
+            with shard.lock:
+                i = shard.index.get(username)
+                return (0, 0) if i is None else (shard.uplinks[i], shard.downlinks[i])
+        
+        def tag_base(tag_stats: dict, tag: str) -> tuple[int, int]:
+            with self._lock:
+                stats = tag_stats.get(tag)
+                return (0, 0) if stats is None else (stats["uplink"], stats["downlink"])
+        
+        user_totals, inbound_totals, outbound_totals = {}, {}, {}
+        accepted = []
+        for report in batch:
+            username, uplink, downlink, inbound_tag, outbound_tag, _ = report
+            user = user_totals[username] if username in user_totals else user_base(username)
+            inbound = (inbound_totals[inbound_tag] if inbound_tag in inbound_totals
+                       else tag_base(self._inbound_stats, inbound_tag))
+            outbound = (outbound_totals[outbound_tag] if outbound_tag in outbound_totals
+                        else tag_base(self._outbound_stats, outbound_tag))
+            user, inbound, outbound = ((up + uplink, down + downlink) for up, down in (user, inbound, outbound))
+            if not all(INT64_MIN <= value <= INT64_MAX for value in (*user, *inbound, *outbound)):
+                logger.error(f"用户 {username} 的上报会使流量累计超出 int64 范围，已丢弃")
+                continue
+            user_totals[username] = user
+            inbound_totals[inbound_tag] = inbound
+            outbound_totals[outbound_tag] = outbound
+            accepted.append(report)
+        return accepted
+    
+    def _apply_deltas(self, users: dict, inbounds: dict, outbounds: dict) -> list[tuple]:
+        """把聚合后的增量写入用户/出入站统计，返回 [(username, 上行, 下行, 累计上行, 累计下行)]
+        
+        users: username -> (上行, 下行, 次数, 最后时间)；inbounds/outbounds: tag -> (上行, 下行)
+        """
+        # 按分片分组，每个分片只加一次锁
+        by_shard = defaultdict(list)
+        for username, deltas in users.items():
+            by_shard[self._shard_for(username)].append((username, deltas))
+        
+        totals = []
+        for shard, entries in by_shard.items():
+            with shard.lock:
+                # 更新用户统计
+                for username, (uplink, downlink, count, ts) in entries:
+                    i = shard.index.get(username)
+                    if i is None:
+                        i = shard.add(username)
+                    
+                    shard.uplinks[i] += uplink
+                    shard.downlinks[i] += downlink
+                    shard.connections[i] += count
+                    shard.last_seen[i] = max(shard.last_seen[i], ts)
+                    totals.append((username, uplink, downlink, shard.uplinks[i], shard.downlinks[i]))
+        # 版本号在数据写入之后更新，读到新版本的线程一定能看到对应的数据
+        self._users_version = next(self._version_counter)
+        
+        with self._lock:
+            # 更新出入站统计（与用户统计独立）
+            for tag_stats, deltas in ((self._inbound_stats, inbounds), (self._outbound_stats, outbounds)):
+                for tag, (uplink, downlink) in deltas.items():
+                    stats = tag_stats[tag]
+                    stats["uplink"] += uplink
+                    stats["downlink"] += downlink
             
-            return result
+            self._tags_version = next(self._version_counter)
+        return totals
+    
+    def get_users_stats_body(self, reset: bool = False) -> bytes:
+        """get-users-stats 的完整响应体（JSON 字节）
+        
+        统计没有变化时直接返回上次序列化的结果，高频轮询不必重复构建和序列化
+        """
+        self._flush_reports()
+        if not reset:
+            cached = self._users_body_cache
+            if cached is not None and cached[0] == self._users_version:
+                return cached[1]
+        
+        users, version = self._collect_users_stats(reset)
+        body = json_dumps({"response": {"users": users}})
+        if not reset:
+            self._users_body_cache = (version, body)
+        return body
+    
+    def _collect_users_stats(self, reset: bool) -> tuple[list[dict], int]:
+        """构建用户流量统计，同时返回对应的数据版本"""
+        # reset=True 时重置用户统计（不影响出入站统计）
+        names, uplinks, downlinks, version = self._collect_user_traffic(reset)
+        
+        # 只返回有流量的用户（在锁外构建）
+        result = [
+            {"username": names[i], "uplink": uplinks[i], "downlink": downlinks[i]}
+            for i in traffic_rows(uplinks, downlinks)
+        ]
+        
+        if reset:
+            logger.info(f"用户流量统计已重置，返回 {len(result)} 条记录")
+        return result, version
     
-    def get_combined_stats(self, reset: bool = False) -> dict:
-        """获取出入站流量统计（remnawave 格式）
+    def get_user_totals(self, reset: bool = False) -> tuple[int, int]:
+        """所有用户的上下行流量合计，reset=True 时同时清零用户流量
         
-        返回格式:
-        {
+        Remnawave 一轮轮询会连续请求四个合计接口，数据没有变化时直接返回缓存的合计。
+        """
+        self._flush_reports()
+        if not reset:
+            cached = self._totals_cache
+            if cached is not None and cached[0] == self._users_version:
+                return cached[1]
+        
+        _, uplinks, downlinks, version = self._collect_user_traffic(reset)
+        totals = column_sum(uplinks), column_sum(downlinks)
+        if not reset:
+            self._totals_cache = (version, totals)
+        return totals
+    
+    def get_last_seen(self, username: str) -> Optional[float]:
+        """用户最后一次上报的时间，未知用户返回 None"""
+        self._flush_reports()
+        shard = self._shard_for(username)
+        with shard.lock:
+            i = shard.index.get(username)
+            return None if i is None else shard.last_seen[i]
+    
+    def is_online(self, username: str, now: Optional[float] = None) -> bool:
+        """用户在 ONLINE_WINDOW 秒内是否有过上报"""
+        last_seen = self.get_last_seen(username)
+        return last_seen is not None and (now or time.time()) - last_seen < self.ONLINE_WINDOW
+    
+    def are_online(self, usernames: Iterable[str], now: Optional[float] = None) -> list[bool]:
+        """批量查询在线状态，结果与 usernames 顺序一致
+        
+        每个涉及的分片只加锁一次，对整列 last_seen 做一次比较，再按下标取结果
+        """
+        self._flush_reports()
+        since = (now or time.time()) - self.ONLINE_WINDOW
+        usernames = list(usernames)
+        by_shard = defaultdict(list)  # 分片 -> [(结果位置, username), ...]
+        for pos, username in enumerate(usernames):
+            by_shard[self._shard_for(username)].append((pos, username))
+        
+        result = [False] * len(usernames)
+        for shard, entries in by_shard.items():
+            with shard.lock:
+                mask = recent_mask(shard.last_seen, since)
+                rows = [shard.index.get(username) for _, username in entries]
+            for (pos, _), i in zip(entries, rows):
+                if i is not None:
+                    result[pos] = mask[i]
+        return result
+    
+    @property
+    def user_count(self) -> int:
+        """已记录的用户数量"""
+        self._flush_reports()
+        return sum(len(shard.names) for shard in self._shards)
+    
+    def get_combined_stats_body(self, reset: bool = False) -> bytes:
+        """get-combined-stats 的完整响应体（JSON 字节），无变化时返回缓存
+        
+        响应格式:
+        {"response": {
             "inbounds": [{"inbound": "tag", "uplink": N, "downlink": N}],
             "outbounds": [{"outbound": "tag", "uplink": N, "downlink": N}]
-        }
+        }}
         """
+        self._flush_reports()
+        if not reset:
+            cached = self._combined_body_cache
+            if cached is not None and cached[0] == self._tags_version:
+                return cached[1]
+        
+        combined, version = self._collect_combined_stats(reset)
+        body = json_dumps({"response": combined})
+        if not reset:
+            self._combined_body_cache = (version, body)
+        return body
+    
+    def _collect_combined_stats(self, reset: bool) -> tuple[dict, int]:
+        """构建出入站流量统计，同时返回对应的数据版本"""
+        if reset:
+            # 重置出入站统计（不影响用户统计），与写日志在同一把锁内
+            with self._log_lock:
+                version, inbound_stats, outbound_stats = self._take_tag_stats(reset=True)
+                self._log_append(RESET_TAGS_RECORD)
+        else:
+            version, inbound_stats, outbound_stats = self._take_tag_stats(reset=False)
+        
+        # 转换入站/出站统计（在锁外构建）
+        inbounds = [
+            {"inbound": tag, "uplink": stats["uplink"], "downlink": stats["downlink"]}
+            for tag, stats in inbound_stats.items()
+            if stats["uplink"] > 0 or stats["downlink"] > 0
+        ]
+        outbounds = [
+            {"outbound": tag, "uplink": stats["uplink"], "downlink": stats["downlink"]}
+            for tag, stats in outbound_stats.items()
+            if stats["uplink"] > 0 or stats["downlink"] > 0
+        ]
+        
+        if reset:
+            logger.info(f"出入站统计已重置，返回 {len(inbounds)} 入站, {len(outbounds)} 出站")
+        return {
+            "inbounds": inbounds,
+            "outbounds": outbounds,
+        }, version
+    
+    def _take_tag_stats(self, reset: bool) -> tuple[int, dict, dict]:
+        """复制出入站统计（reset=True 时同时清零），返回 (数据版本, 入站, 出站)"""
         with self._lock:
-            inbounds = []
-            outbounds = []
-            
-            # 转换入站统计
-            for tag, stats in self._inbound_stats.items():
-                if stats["uplink"] > 0 or stats["downlink"] > 0:
-                    inbounds.append({
-                        "inbound": tag,
-                        "uplink": stats["uplink"],
-                        "downlink": stats["downlink"],
-                    })
-            
-            # 转换出站统计
-            for tag, stats in self._outbound_stats.items():
-                if stats["uplink"] > 0 or stats["downlink"] > 0:
-                    outbounds.append({
-                        "outbound": tag,
-                        "uplink": stats["uplink"],
-                        "downlink": stats["downlink"],
-                    })
-            
+            version = self._tags_version
+            inbound_stats, outbound_stats = self._snapshot_tag_stats()
             if reset:
-                # 重置出入站统计（不影响用户统计）
                 for stats in self._inbound_stats.values():
                     stats["uplink"] = 0
                     stats["downlink"] = 0
                 for stats in self._outbound_stats.values():
                     stats["uplink"] = 0
                     stats["downlink"] = 0
-                logger.info(f"出入站统计已重置，返回 {len(inbounds)} 入站, {len(outbounds)} 出站")
-            
-            return {
-                "inbounds": inbounds,
-                "outbounds": outbounds,
-            }
+                self._tags_version = next(self._version_counter)
+        return version, inbound_stats, outbound_stats
     
     def set_tags_from_xray_config(self, xray_config: dict) -> tuple[str, str]:
         """从 xrayConfig 中提取并设置出入站标签和 uuid->email 映射
@@ -410,7 +1382,7 @@ class StatsStore:
                     client_id = client.get('id')  # VLESS UUID
                     client_email = client.get('email')  # Xray 用于统计的标识
                     if client_id and client_email:
-                        self._uuid_to_email[client_id.lower()] = client_email
+                        self._uuid_to_email[sys.intern(client_id.lower())] = client_email
                         uuid_email_count += 1
         
         # 提取出站标签（protocol 为 freedom 的，或第一个）
@@ -431,6 +1403,7 @@ class StatsStore:
         with self._lock:
             self._current_inbound_tag = inbound_tag
             self._current_outbound_tag = outbound_tag
+            self._dirty_count += 1
         
         logger.info(f"从 xrayConfig 设置: inbound={inbound_tag}, outbound={outbound_tag}, uuid->email 映射 {uuid_email_count} 个")
         return inbound_tag, outbound_tag
@@ -438,9 +1411,9 @@ class StatsStore:
     def get_email_by_uuid(self, uuid: str) -> str:
         """根据 UUID 获取对应的 email（用于流量统计标识）
         
-        如果没有映射，返回 UUID 本身
+        如果没有映射，返回 UUID 本身。调用方需传入小写 UUID（在请求入口统一转换一次）
         """
-        return self._uuid_to_email.get(uuid.lower(), uuid)
+        return self._uuid_to_email.get(uuid, uuid)
     
     @property
     def current_inbound_tag(self) -> str:
@@ -456,22 +1429,22 @@ class StatsStore:
         """获取系统统计（模拟 Xray 内部统计格式）
         
         这是 Xray gRPC Stats API 返回的格式，用于监控 Xray 进程本身的状态
+        （只读取启动时间，无需加锁）
         """
-        with self._lock:
-            uptime_seconds = int(time.time() - self._start_time)
-            # 模拟 Xray 的内存和 GC 统计
-            return {
-                "numGoroutine": 50,        # 模拟 goroutine 数量
-                "numGC": uptime_seconds // 60,  # 模拟 GC 次数
-                "alloc": 1024 * 1024 * 20,     # 模拟当前分配内存 (~20MB)
-                "totalAlloc": 1024 * 1024 * 100,  # 模拟总分配内存
-                "sys": 1024 * 1024 * 50,       # 模拟系统内存
-                "mallocs": 10000,              # 模拟 malloc 次数
-                "frees": 9000,                 # 模拟 free 次数
-                "liveObjects": 1000,           # 模拟活跃对象数
-                "pauseTotalNs": 1000000,       # 模拟 GC 暂停时间 (纳秒)
-                "uptime": uptime_seconds,      # 运行时间（秒）
-            }
+        uptime_seconds = int(time.time() - self._start_time)
+        # 模拟 Xray 的内存和 GC 统计
+        return {
+            "numGoroutine": 50,        # 模拟 goroutine 数量
+            "numGC": uptime_seconds // 60,  # 模拟 GC 次数
+            "alloc": 1024 * 1024 * 20,     # 模拟当前分配内存 (~20MB)
+            "totalAlloc": 1024 * 1024 * 100,  # 模拟总分配内存
+            "sys": 1024 * 1024 * 50,       # 模拟系统内存
+            "mallocs": 10000,              # 模拟 malloc 次数
+            "frees": 9000,                 # 模拟 free 次数
+            "liveObjects": 1000,           # 模拟活跃对象数
+            "pauseTotalNs": 1000000,       # 模拟 GC 暂停时间 (纳秒)
+            "uptime": uptime_seconds,      # 运行时间（秒）
+        }
     
     def get_node_system_info(self) -> dict:
         """获取节点系统信息（用于 xray/start 响应）
@@ -491,22 +1464,37 @@ class StatsStore:
             "memoryTotal": "4 GB",  # 模拟值
         }
     
-    def get_all_stats(self) -> dict:
-        """获取详细统计信息"""
-        with self._lock:
-            return {
-                "users": [
-                    {
-                        "username": u.username,
-                        "uplink": u.uplink,
-                        "downlink": u.downlink,
-                        "connections": u.connections,
-                        "lastSeen": datetime.fromtimestamp(u.last_seen).isoformat(),
-                    }
-                    for u in self._stats.values()
-                ],
-                "system": self.get_system_stats(),
-                "uuidMappings": self._uuid_mapping.get_all_mappings(),
+    def iter_all_stats_json(self) -> Iterator[bytes]:
+        """逐段生成 /stats 的详细统计 JSON（每个用户一行）
+        
+        格式为 {"users": [...], "system": {...}, "uuidMappings": {...}}。
+        用于分块传输：不必先构建全部用户的 dict 和完整的响应体
+        """
+        self._flush_reports()
+        users = self._iter_user_details()
+        system = self.get_system_stats()
+        mappings = self._uuid_mapping.get_all_mappings()
+        
+        yield b'{"users":['
+        separator = b'\n'
+        for user in users:
+            yield separator + json_dumps(user)
+            separator = b',\n'
+        yield (b'\n],"system":' + json_dumps(system)
+               + b',"uuidMappings":' + json_dumps(mappings) + b'}')
+    
+    def _iter_user_details(self) -> Iterator[dict]:
+        """按列快照逐个生成用户详细统计（快照在首次迭代时获取）"""
+        columns = self._snapshot_user_columns()
+        # 绑定到局部变量，每个用户少一次全局+属性查找
+        fromtimestamp = datetime.fromtimestamp
+        for name, up, down, conns, seen in zip(*columns):
+            yield {
+                "username": name,
+                "uplink": up,
+                "downlink": down,
+                "connections": conns,
+                "lastSeen": fromtimestamp(seen).isoformat(),
             }
 
 
@@ -524,40 +1512,175 @@ def init_stats_store(data_file: Optional[str] = None):
 # HTTP 请求处理
 # ============================================================================
 
+# 内容固定的响应体：模块加载时序列化一次，请求时直接发送
+XRAY_HEALTHCHECK_BODY = json_dumps({
+    "response": {
+        "isAlive": True,
+        "xrayInternalStatusCached": True,  # Worker 模拟始终在线
+        "xrayVersion": "1.8.24",  # 模拟版本
+        "nodeVersion": "1.0.0-worker"  # Worker 版本标识
+    }
+})
+XRAY_STATUS_BODY = json_dumps({
+    "response": {
+        "isRunning": True,
+        "version": "1.8.24"
+    }
+})
+XRAY_STOP_BODY = json_dumps({
+    "response": {
+        "isStopped": True
+    }
+})
+WORKER_SUCCESS_BODY = json_dumps({"success": True})
+HANDLER_SUCCESS_BODY = json_dumps({"response": {"success": True, "error": None}})
+INBOUND_USERS_BODY = json_dumps({
+    "response": {
+        "users": []
+    }
+})
+# /health 只有 timestamp 随请求变化，拼接在固定前缀之后
+HEALTH_BODY_PREFIX = json_dumps({"status": "ok", "service": "remnawave-node-mock", "timestamp": ""})[:-2]
+
+
 class NodeHandler(BaseHTTPRequestHandler):
     """模拟 Remnawave Node 的 HTTP 处理器"""
     
-    # 配置（由 server 设置）
-    jwt_public_key: Optional[str] = None
-    no_auth: bool = False
+    # HTTP/1.1 默认保持连接：轮询和上报复用同一连接，省去每次请求的 TCP/TLS 握手
+    # （所有响应都带 Content-Length，连接上的请求边界始终明确）
+    protocol_version = 'HTTP/1.1'
+    # 空闲连接的超时时间（秒），同时限制 TLS 握手和读取请求的等待时间
+    timeout = 30
+    # 带缓冲的 wfile：响应头和响应体在缓冲区中合并，处理完请求后一次 flush 发出
+    # （默认 wbufsize=0 时响应头和响应体分两次 send，TLS 下各自成为单独的记录）
+    wbufsize = 64 * 1024
+    # TCP_NODELAY（StreamRequestHandler.setup 中设置）：小响应和 TLS 握手消息不必等待 Nagle 合并
+    disable_nagle_algorithm = True
+    
+    # 配置（启动时由 configure_auth 设置）
+    jwt_public_key: Optional[object] = None  # 预解析的公钥对象（见 load_jwt_public_key）
     
+    # 本次请求新签发的会话 ID（随下一个响应的 X-Session 头返回）
+    _new_session: Optional[str] = None
+    
+    def handle(self):
+        """在处理线程中完成 TLS 握手，再交给 BaseHTTPRequestHandler"""
+        if isinstance(self.connection, ssl.SSLSocket):
+            try:
+                self.connection.do_handshake()
+            except (ssl.SSLError, OSError) as e:
+                logger.debug(f"{self.address_string()} - TLS 握手失败: {e}")
+                return
+        super().handle()
+
+    def handle_expect_100(self):
+        """立即发出 100 Continue（wfile 带缓冲，不 flush 会一直留到最终响应才发出）"""
+        result = super().handle_expect_100()
+        self.wfile.flush()
+        return result
+
     def log_message(self, format, *args):
         """自定义日志格式"""
         logger.debug(f"{self.address_string()} - {format % args}")
     
     def send_json(self, data: dict, status: int = 200):
         """发送 JSON 响应"""
-        body = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+        self.send_raw_json(json_dumps(data), status)
+    
+    def send_raw_json(self, body: bytes, status: int = 200):
+        """发送已序列化的 JSON 响应体"""
+        encoding = None
+        if len(body) >= COMPRESS_MIN_SIZE:
+            encoding = choose_response_encoding(self.headers.get('Accept-Encoding', ''))
+            if encoding:
+                body = compress_response(body, encoding)
+        
+        self.send_json_headers(status, encoding, len(body))
+        self.wfile.write(body)
+    
+    def send_json_headers(self, status: int, encoding: Optional[str], length: Optional[int] = None):
+        """发送 JSON 响应的状态行和响应头（length 为 None 时使用分块传输）
+        
+        本次请求新签发的会话 ID 随这个响应返回，之后清空，不会带到连接上的下一个响应
+        """
         self.send_response(status)
         self.send_header('Content-Type', 'application/json; charset=utf-8')
-        self.send_header('Content-Length', len(body))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Vary', 'Accept-Encoding')
+        if length is None:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', length)
+        if self._new_session:
+            self.send_header('X-Session', self._new_session)
+            self._new_session = None
+        if self.close_connection:
+            # 告知客户端本次响应后连接会关闭
+            self.send_header('Connection', 'close')
         self.end_headers()
-        self.wfile.write(body)
+    
+    def send_json_stream(self, chunks: Iterable[bytes], status: int = 200):
+        """以 Transfer-Encoding: chunked 流式发送 JSON 响应（用于大的响应）
+        
+        不需要预先知道完整的响应体大小，内存占用只有一个 chunk。
+        HTTP/1.0 客户端不支持分块传输，仍然拼接成完整响应体发送。
+        """
+        if self.request_version == 'HTTP/1.0':
+            self.send_raw_json(b''.join(chunks), status)
+            return
+        
+        encoding = choose_response_encoding(self.headers.get('Accept-Encoding', ''))
+        compressor = response_compressor(encoding) if encoding else None
+        
+        self.send_json_headers(status, encoding)
+        
+        def write_chunk(data: bytes):
+            if data:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        
+        buffer = bytearray()
+        for piece in chunks:
+            buffer += piece
+            if len(buffer) >= STREAM_CHUNK_SIZE:
+                write_chunk(compressor.compress(buffer) if compressor else bytes(buffer))
+                buffer.clear()
+        if compressor:
+            write_chunk(compressor.compress(buffer) + compressor.flush())
+        else:
+            write_chunk(bytes(buffer))
+        self.wfile.write(b'0\r\n\r\n')
     
     def send_error_json(self, message: str, status: int = 400):
         """发送错误响应"""
         self.send_json({"error": message}, status)
     
-    def verify_jwt(self) -> bool:
-        """验证 JWT Bearer Token"""
-        if self.no_auth:
-            return True
+    @classmethod
+    def configure_auth(cls, jwt_public_key: Optional[object]):
+        """启动时按认证模式选定 verify_jwt 的实现，请求处理时不再判断模式
         
-        if not self.jwt_public_key:
-            return True
-        
-        if not HAS_JWT:
+        没有公钥（--no-auth 或未提供 SECRET_KEY）或未安装 PyJWT 时一律放行。
+        """
+        cls.jwt_public_key = jwt_public_key
+        if jwt_public_key and not HAS_JWT:
             logger.warning("PyJWT 未安装，跳过 JWT 验证")
+        if jwt_public_key and HAS_JWT:
+            cls.verify_jwt = cls._verify_jwt_token
+        else:
+            cls.verify_jwt = cls._verify_jwt_skip
+    
+    def _verify_jwt_skip(self) -> bool:
+        """未启用 JWT 验证：所有请求直接通过"""
+        return True
+    
+    verify_jwt = _verify_jwt_skip
+    
+    def _verify_jwt_token(self) -> bool:
+        """验证 JWT Bearer Token"""
+        # 带有效会话 ID 时直接通过，不解析 token
+        now = time.time()
+        session = self.headers.get('X-Session')
+        if session and _SESSIONS.hit(session.encode(), now):
             return True
         
         auth_header = self.headers.get('Authorization', '')
@@ -566,13 +1689,23 @@ class NodeHandler(BaseHTTPRequestHandler):
         
         token = auth_header[7:]
         
+        # 命中缓存且未失效时直接通过
+        token_hash = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        if _JWT_CACHE.hit(token_hash, now):
+            return True
+        
+        jwt = jwt_module()
         try:
-            jwt.decode(
+            claims = jwt.decode(
                 token, 
                 self.jwt_public_key, 
                 algorithms=['RS256'],
                 options={"verify_exp": True}
             )
+            # 只缓存验证成功的 token，同时签发会话 ID
+            _JWT_CACHE.add(token_hash, claims.get('exp'), now)
+            self._new_session = secrets.token_urlsafe(16)
+            _SESSIONS.add(self._new_session.encode(), claims.get('exp'), now)
             return True
         except jwt.ExpiredSignatureError:
             logger.warning("JWT token 已过期")
@@ -582,429 +1715,429 @@ class NodeHandler(BaseHTTPRequestHandler):
             return False
     
     def get_json_body(self) -> Optional[dict]:
-        """解析 JSON 请求体（支持 zstd/gzip 压缩）"""
-        content_length = int(self.headers.get('Content-Length', 0))
-        if content_length == 0:
+        """解析 JSON 请求体（支持 zstd/gzip 压缩和分块传输）"""
+        # 带 Transfer-Encoding 时忽略 Content-Length（RFC 9112 6.3）
+        transfer_encoding = self.headers.get('Transfer-Encoding', '').strip().lower()
+        content_length = 0 if transfer_encoding else int(self.headers.get('Content-Length', 0))
+        if content_length == 0 and not transfer_encoding:
             return {}
         
         try:
-            body = self.rfile.read(content_length)
-            
             # 检查 Content-Encoding
             content_encoding = self.headers.get('Content-Encoding', '').lower()
+            compressed = content_encoding == 'gzip' or (content_encoding == 'zstd' and HAS_ZSTD)
             
-            # 尝试解压缩
-            if content_encoding == 'zstd' or (len(body) >= 4 and body[:4] == b'\x28\xb5\x2f\xfd'):
-                # zstd 压缩（魔数: 0x28B52FFD）
-                if HAS_ZSTD:
-                    dctx = zstd.ZstdDecompressor()
-                    body = dctx.decompress(body)
+            if compressed and not transfer_encoding:
+                # 已声明压缩格式：直接从连接流式解压，不先读出完整的压缩数据
+                source = RequestBody(self.rfile, content_length)
+                body = decompress_body(io.BufferedReader(source, READ_BUFFER_SIZE),
+                                       content_encoding, content_length)
+                source.discard_rest()
+            else:
+                if transfer_encoding:
+                    if transfer_encoding != 'chunked':
+                        raise ValueError(f"不支持的 Transfer-Encoding: {transfer_encoding}")
+                    body = read_chunked_body(self.rfile)
+                    if not body:
+                        return {}
                 else:
+                    body = self.rfile.read(content_length)
+                if compressed:
+                    body = decompress_body(io.BytesIO(body), content_encoding, len(body))
+                elif content_encoding == 'zstd':
                     logger.warning("收到 zstd 压缩数据但 zstandard 未安装")
                     # 尝试直接解析（可能是误判）
-            elif content_encoding == 'gzip' or (len(body) >= 2 and body[:2] == b'\x1f\x8b'):
-                # gzip 压缩（魔数: 0x1F8B）
-                body = gzip.decompress(body)
+                elif not content_encoding:
+                    # 未声明 Content-Encoding 时按魔数识别
+                    if body[:4] == ZSTD_MAGIC and HAS_ZSTD:
+                        body = decompress_body(io.BytesIO(body), 'zstd', len(body))
+                    elif body[:2] == GZIP_MAGIC:
+                        body = decompress_body(io.BytesIO(body), 'gzip', len(body))
             
-            return json.loads(body.decode('utf-8'))
+            return json_loads(body)
         except Exception as e:
             logger.warning(f"JSON 解析失败: {e}")
+            # 请求体可能没有读完，不能再复用这个连接
+            self.close_connection = True
             return None
     
     def do_GET(self):
-        """处理 GET 请求"""
-        parsed = urlparse(self.path)
-        path = parsed.path
-        
-        # 健康检查（无需认证）
-        if path == '/health' or path == '/':
-            self.send_json({
-                "status": "ok",
-                "service": "remnawave-node-mock",
-                "timestamp": datetime.now().isoformat(),
-            })
-            return
-        
-        # /node/* 路径需要 JWT 认证
-        if path.startswith('/node/'):
-            if not self.verify_jwt():
-                self.send_error_json("Unauthorized", 401)
-                return
-        
-        if path == '/node/stats/get-system-stats':
-            self.send_json({
-                "response": stats_store.get_system_stats()
-            })
-        
-        # =====================================================================
-        # Xray 控制接口（模拟）
-        # =====================================================================
-        
-        elif path == '/node/xray/healthcheck':
-            # 节点健康检查
-            self.send_json({
-                "response": {
-                    "isAlive": True,
-                    "xrayInternalStatusCached": True,  # Worker 模拟始终在线
-                    "xrayVersion": "1.8.24",  # 模拟版本
-                    "nodeVersion": "1.0.0-worker"  # Worker 版本标识
-                }
-            })
-        
-        elif path == '/node/xray/status':
-            # Xray 状态和版本
-            self.send_json({
-                "response": {
-                    "isRunning": True,
-                    "version": "1.8.24"
-                }
-            })
-        
-        elif path == '/node/xray/stop':
-            # 停止 Xray（Worker 不需要真的停止）
-            logger.info("收到停止请求（Worker 模式忽略）")
-            self.send_json({
-                "response": {
-                    "isStopped": True
-                }
-            })
-        
-        elif path == '/stats':
-            # 自定义：获取详细统计（需要认证）
-            if not self.verify_jwt():
-                self.send_error_json("Unauthorized", 401)
-                return
-            self.send_json(stats_store.get_all_stats())
-        
-        elif path == '/mappings':
-            # 自定义：获取 UUID 映射
-            self.send_json(stats_store.uuid_mapping.get_all_mappings())
-        
-        else:
+        """处理 GET 请求：按路径查表分发"""
+        route = self._GET_ROUTES.get(urlparse(self.path).path)
+        if route is None:
             self.send_error_json("Not Found", 404)
+            return
+        handler, needs_jwt = route
+        if needs_jwt and not self.verify_jwt():
+            self.send_error_json("Unauthorized", 401)
+            return
+        handler(self)
     
     def do_POST(self):
-        """处理 POST 请求"""
-        parsed = urlparse(self.path)
-        path = parsed.path
+        """处理 POST 请求：按路径查表分发"""
+        route = self._POST_ROUTES.get(urlparse(self.path).path)
         
         body = self.get_json_body()
         if body is None:
             self.send_error_json("Invalid JSON body", 400)
             return
         
-        # =====================================================================
-        # Worker 流量上报接口（自定义，无需 JWT）
-        # =====================================================================
-        
-        if path == '/worker/report':
-            # Worker 上报流量
-            # 直接使用 vlessUuid，Remnawave 就是用 vlessUuid 作为统计标识
-            uuid = body.get('uuid')
-            uplink = body.get('uplink', 0)
-            downlink = body.get('downlink', 0)
-            # 可选的 tag 参数（用于出入站统计）
-            inbound_tag = body.get('inboundTag') or 'worker'
-            outbound_tag = body.get('outboundTag') or 'worker'
-            
-            if not uuid:
-                self.send_error_json("uuid is required", 400)
-                return
-            
-            try:
-                uplink = int(uplink)
-                downlink = int(downlink)
-            except (ValueError, TypeError):
-                self.send_error_json("uplink/downlink must be integers", 400)
-                return
-            
-            # 上报流量（uuid 会自动转换为 email）
-            email = stats_store.get_email_by_uuid(uuid)
-            stats_store.report(uuid, uplink, downlink,
-                             inbound_tag=inbound_tag, outbound_tag=outbound_tag)
-            
-            if email != uuid:
-                logger.info(f"流量上报: {uuid} -> {email}, ↑{uplink} ↓{downlink}")
-            else:
-                logger.info(f"流量上报: {uuid}, ↑{uplink} ↓{downlink}")
-            
-            self.send_json({"success": True})
+        if route is None:
+            self.send_error_json("Not Found", 404)
             return
-        
-        if path == '/worker/batch-report':
-            # Worker 批量上报流量
-            reports = body.get('reports', [])
-            if not isinstance(reports, list):
-                self.send_error_json("reports must be an array", 400)
-                return
-            
-            count = 0
-            for report in reports:
-                uuid = report.get('uuid')
-                uplink = report.get('uplink', 0)
-                downlink = report.get('downlink', 0)
-                inbound_tag = report.get('inboundTag')
-                outbound_tag = report.get('outboundTag')
-                
-                if uuid:
-                    try:
-                        stats_store.report(uuid, int(uplink), int(downlink),
-                                         inbound_tag=inbound_tag, outbound_tag=outbound_tag)
-                        count += 1
-                    except (ValueError, TypeError):
-                        pass
-            
-            logger.info(f"批量流量上报: 处理 {count} 条记录")
-            self.send_json({"success": True, "processed": count})
+        handler, needs_jwt = route
+        if needs_jwt and not self.verify_jwt():
+            self.send_error_json("Unauthorized", 401)
             return
-        
-        if path == '/worker/add-mapping':
-            # 添加 UUID -> userId 映射
-            uuid = body.get('uuid')
-            user_id = body.get('userId')
-            
-            if not uuid or not user_id:
-                self.send_error_json("uuid and userId are required", 400)
-                return
-            
-            stats_store.uuid_mapping.add_mapping(uuid, user_id)
-            logger.info(f"添加映射: {uuid} -> {user_id}")
-            self.send_json({"success": True})
+        handler(self, body)
+    
+    # =========================================================================
+    # GET 接口
+    # =========================================================================
+    
+    def _get_health(self):
+        # 健康检查（无需认证）
+        self.send_raw_json(HEALTH_BODY_PREFIX + datetime.now().isoformat().encode() + b'"}')
+    
+    def _get_system_stats(self):
+        self.send_json({
+            "response": stats_store.get_system_stats()
+        })
+    
+    # Xray 控制接口（模拟）
+    
+    def _get_xray_healthcheck(self):
+        # 节点健康检查
+        self.send_raw_json(XRAY_HEALTHCHECK_BODY)
+    
+    def _get_xray_status(self):
+        # Xray 状态和版本
+        self.send_raw_json(XRAY_STATUS_BODY)
+    
+    def _get_xray_stop(self):
+        # 停止 Xray（Worker 不需要真的停止）
+        logger.info("收到停止请求（Worker 模式忽略）")
+        self.send_raw_json(XRAY_STOP_BODY)
+    
+    def _get_stats(self):
+        # 自定义：获取详细统计（需要认证）
+        # 用户较多时响应很大，分块流式发送
+        self.send_json_stream(stats_store.iter_all_stats_json())
+    
+    def _get_mappings(self):
+        # 自定义：获取 UUID 映射
+        self.send_json(stats_store.uuid_mapping.get_all_mappings())
+    
+    # =========================================================================
+    # Worker 流量上报接口（自定义，无需 JWT）
+    # =========================================================================
+    
+    def _post_worker_report(self, body: dict):
+        # Worker 上报流量
+        # 直接使用 vlessUuid，Remnawave 就是用 vlessUuid 作为统计标识
+        uuid = body.get('uuid')
+        uplink = body.get('uplink', 0)
+        downlink = body.get('downlink', 0)
+        # 可选的 tag 参数（用于出入站统计）
+        inbound_tag = body.get('inboundTag') or 'worker'
+        outbound_tag = body.get('outboundTag') or 'worker'
+        
+        if not uuid:
+            self.send_error_json("uuid is required", 400)
             return
+        uuid = str(uuid).lower()  # 入口处统一转换为小写，后续查找不再重复转换
         
-        if path == '/worker/batch-add-mapping':
-            # 批量添加映射
-            mappings = body.get('mappings', [])
-            count = 0
-            for m in mappings:
-                uuid = m.get('uuid')
-                user_id = m.get('userId')
-                if uuid and user_id:
-                    stats_store.uuid_mapping.add_mapping(uuid, user_id)
-                    count += 1
-            logger.info(f"批量添加映射: {count} 条")
-            self.send_json({"success": True, "processed": count})
+        try:
+            uplink = parse_traffic(uplink)
+            downlink = parse_traffic(downlink)
+        except (ValueError, TypeError):
+            self.send_error_json("uplink/downlink must be 64-bit integers", 400)
             return
         
-        # =====================================================================
-        # Remnawave 主机轮询接口（需要 JWT）
-        # =====================================================================
+        # 上报流量（uuid 会自动转换为 email）
+        email = stats_store.report(uuid, uplink, downlink,
+                                   inbound_tag=inbound_tag, outbound_tag=outbound_tag)
         
-        if path.startswith('/node/'):
-            if not self.verify_jwt():
-                self.send_error_json("Unauthorized", 401)
-                return
-        
-        # =====================================================================
-        # Xray 控制接口（POST）
-        # =====================================================================
+        if email != uuid:
+            logger.info(f"流量上报: {uuid} -> {email}, ↑{uplink} ↓{downlink}")
+        else:
+            logger.info(f"流量上报: {uuid}, ↑{uplink} ↓{downlink}")
         
-        if path == '/node/xray/start':
-            # 启动 Xray（Worker 模式下模拟成功）
-            # 请求体包含 xrayConfig 和 internals
-            logger.info("收到启动请求（Worker 模式模拟成功）")
-            
-            logger.info(f"请求体: {body}")
-
-            # 从 xrayConfig 中提取出入站标签
-            xray_config = body.get('xrayConfig', {})
-            if xray_config:
-                inbound_tag, outbound_tag = stats_store.set_tags_from_xray_config(xray_config)
-                logger.info(f"使用标签: inbound={inbound_tag}, outbound={outbound_tag}")
-            
-            # 响应格式与 remnawave/node 的 StartXrayResponseModel 一致
-            self.send_json({
-                "response": {
-                    "isStarted": True,
-                    "version": "1.8.24",  # Xray 版本
-                    "error": None,
-                    "systemInformation": stats_store.get_node_system_info(),  # 节点硬件信息
-                    "nodeInformation": {
-                        "version": "1.0.0-worker"  # Node 版本
-                    }
-                }
-            })
+        self.send_raw_json(WORKER_SUCCESS_BODY)
+    
+    def _post_worker_batch_report(self, body: dict):
+        # Worker 批量上报流量
+        reports = body.get('reports', [])
+        if not isinstance(reports, list):
+            self.send_error_json("reports must be an array", 400)
             return
         
-        if path == '/node/stats/get-users-stats':
-            reset = body.get('reset', False)
-            users = stats_store.get_users_stats(reset=reset)
-            self.send_json({
-                "response": {
-                    "users": users
-                }
-            })
-            return
+        # 先校验整批，再一次性写入
+        # （解码出的键不是驻留的字面量，report.get() 在哈希相同后回退为逐字节比较；
+        #  这些键都很短，比较的开销很小，对每个解码出的键调用 sys.intern 反而更慢）
+        items = []
+        for report in reports:
+            uuid = report.get('uuid')
+            if not uuid:
+                continue
+            try:
+                items.append((str(uuid).lower(), parse_traffic(report.get('uplink', 0)),
+                              parse_traffic(report.get('downlink', 0)),
+                              report.get('inboundTag'), report.get('outboundTag')))
+            except (ValueError, TypeError):
+                pass
         
-        if path == '/node/stats/get-user-online-status':
-            username = body.get('username', '')
-            # 简化实现：检查最近 5 分钟内是否有活动
-            with stats_store._lock:
-                user = stats_store._stats.get(username)
-                online = user is not None and (time.time() - user.last_seen < 300)
-            self.send_json({
-                "response": {
-                    "online": online
-                }
-            })
-            return
+        count = stats_store.report_batch(items)
+        logger.info(f"批量流量上报: 处理 {count} 条记录")
+        self.send_json({"success": True, "processed": count})
+    
+    def _post_worker_add_mapping(self, body: dict):
+        # 添加 UUID -> userId 映射
+        uuid = body.get('uuid')
+        user_id = body.get('userId')
         
-        if path == '/node/stats/get-inbound-stats':
-            reset = body.get('reset', False)
-            with stats_store._lock:
-                total_up = sum(u.uplink for u in stats_store._stats.values())
-                total_down = sum(u.downlink for u in stats_store._stats.values())
-                if reset:
-                    for u in stats_store._stats.values():
-                        u.uplink = 0
-                        u.downlink = 0
-            self.send_json({
-                "response": {
-                    "inbound": body.get('tag', 'worker'),
-                    "uplink": total_up,
-                    "downlink": total_down,
-                }
-            })
+        if not uuid or not user_id:
+            self.send_error_json("uuid and userId are required", 400)
             return
         
-        if path == '/node/stats/get-outbound-stats':
-            reset = body.get('reset', False)
-            with stats_store._lock:
-                total_up = sum(u.uplink for u in stats_store._stats.values())
-                total_down = sum(u.downlink for u in stats_store._stats.values())
-                if reset:
-                    for u in stats_store._stats.values():
-                        u.uplink = 0
-                        u.downlink = 0
-            self.send_json({
-                "response": {
-                    "outbound": body.get('tag', 'worker'),
-                    "uplink": total_up,
-                    "downlink": total_down,
-                }
-            })
-            return
-        
-        if path == '/node/stats/get-all-inbounds-stats':
-            reset = body.get('reset', False)
-            with stats_store._lock:
-                total_up = sum(u.uplink for u in stats_store._stats.values())
-                total_down = sum(u.downlink for u in stats_store._stats.values())
-                if reset:
-                    for u in stats_store._stats.values():
-                        u.uplink = 0
-                        u.downlink = 0
-            self.send_json({
-                "response": {
-                    "inbounds": [{
-                        "inbound": "worker",
-                        "uplink": total_up,
-                        "downlink": total_down,
-                    }]
-                }
-            })
-            return
+        stats_store.uuid_mapping.add_mapping(uuid, user_id)
+        logger.info(f"添加映射: {uuid} -> {user_id}")
+        self.send_raw_json(WORKER_SUCCESS_BODY)
+    
+    def _post_worker_batch_add_mapping(self, body: dict):
+        # 批量添加映射
+        mappings = body.get('mappings', [])
+        count = 0
+        for m in mappings:
+            uuid = m.get('uuid')
+            user_id = m.get('userId')
+            if uuid and user_id:
+                stats_store.uuid_mapping.add_mapping(uuid, user_id)
+                count += 1
+        logger.info(f"批量添加映射: {count} 条")
+        self.send_json({"success": True, "processed": count})
+    
+    # =========================================================================
+    # Xray 控制接口（POST，需要 JWT）
+    # =========================================================================
+    
+    def _post_xray_start(self, body: dict):
+        # 启动 Xray（Worker 模式下模拟成功）
+        # 请求体包含 xrayConfig 和 internals
+        logger.info("收到启动请求（Worker 模式模拟成功）")
         
-        if path == '/node/stats/get-all-outbounds-stats':
-            reset = body.get('reset', False)
-            with stats_store._lock:
-                total_up = sum(u.uplink for u in stats_store._stats.values())
-                total_down = sum(u.downlink for u in stats_store._stats.values())
-                if reset:
-                    for u in stats_store._stats.values():
-                        u.uplink = 0
-                        u.downlink = 0
-            self.send_json({
-                "response": {
-                    "outbounds": [{
-                        "outbound": "worker",
-                        "uplink": total_up,
-                        "downlink": total_down,
-                    }]
+        logger.info(f"请求体: {body}")
+
+        # 从 xrayConfig 中提取出入站标签
+        xray_config = body.get('xrayConfig', {})
+        if xray_config:
+            inbound_tag, outbound_tag = stats_store.set_tags_from_xray_config(xray_config)
+            logger.info(f"使用标签: inbound={inbound_tag}, outbound={outbound_tag}")
+        
+        # 响应格式与 remnawave/node 的 StartXrayResponseModel 一致
+        self.send_json({
+            "response": {
+                "isStarted": True,
+                "version": "1.8.24",  # Xray 版本
+                "error": None,
+                "systemInformation": stats_store.get_node_system_info(),  # 节点硬件信息
+                "nodeInformation": {
+                    "version": "1.0.0-worker"  # Node 版本
                 }
-            })
-            return
-        
-        if path == '/node/stats/get-combined-stats':
-            reset = body.get('reset', False)
-            combined = stats_store.get_combined_stats(reset=reset)
-            self.send_json({
-                "response": combined
-            })
-            return
-        
-        # =====================================================================
-        # Handler 接口（用户管理）
-        # =====================================================================
+            }
+        })
+    
+    # =========================================================================
+    # Remnawave 主机轮询接口（需要 JWT）
+    # =========================================================================
+    
+    def _post_get_users_stats(self, body: dict):
+        reset = body.get('reset', False)
+        self.send_raw_json(stats_store.get_users_stats_body(reset=reset))
+    
+    def _post_get_user_online_status(self, body: dict):
+        username = body.get('username', '')
+        # 简化实现：检查最近 5 分钟内是否有活动
+        self.send_json({
+            "response": {
+                "online": stats_store.is_online(username)
+            }
+        })
+    
+    def _send_totals(self, body: dict, key: str, plural: Optional[str] = None):
+        """inbound/outbound 合计接口的共同实现（所有用户流量合计）
         
-        if path == '/node/handler/add-user':
-            # 添加单个用户
-            data = body.get('data', [])
-            hash_data = body.get('hashData', {})
-            
-            if data and hash_data:
-                # 从请求中提取 UUID -> username 映射
-                username = data[0].get('username') if data else None
-                vless_uuid = hash_data.get('vlessUuid')
-                
-                if username and vless_uuid:
-                    stats_store.uuid_mapping.add_mapping(vless_uuid, username)
-                    logger.info(f"从 add-user 添加映射: {vless_uuid} -> {username}")
+        plural 为 None 时返回单个对象（tag 取自请求），否则返回只含 worker 一项的列表
+        """
+        total_up, total_down = stats_store.get_user_totals(reset=body.get('reset', False))
+        if plural is None:
+            stats = {key: body.get('tag', 'worker'), "uplink": total_up, "downlink": total_down}
+            self.send_json({"response": stats})
+        else:
+            stats = {key: "worker", "uplink": total_up, "downlink": total_down}
+            self.send_json({"response": {plural: [stats]}})
+    
+    def _post_get_inbound_stats(self, body: dict):
+        self._send_totals(body, "inbound")
+    
+    def _post_get_outbound_stats(self, body: dict):
+        self._send_totals(body, "outbound")
+    
+    def _post_get_all_inbounds_stats(self, body: dict):
+        self._send_totals(body, "inbound", "inbounds")
+    
+    def _post_get_all_outbounds_stats(self, body: dict):
+        self._send_totals(body, "outbound", "outbounds")
+    
+    def _post_get_combined_stats(self, body: dict):
+        reset = body.get('reset', False)
+        self.send_raw_json(stats_store.get_combined_stats_body(reset=reset))
+    
+    # =========================================================================
+    # Handler 接口（用户管理，需要 JWT）
+    # =========================================================================
+    
+    def _post_add_user(self, body: dict):
+        # 添加单个用户
+        data = body.get('data', [])
+        hash_data = body.get('hashData', {})
+        
+        if data and hash_data:
+            # 从请求中提取 UUID -> username 映射
+            username = data[0].get('username') if data else None
+            vless_uuid = hash_data.get('vlessUuid')
             
-            self.send_json({"response": {"success": True, "error": None}})
-            return
+            if username and vless_uuid:
+                stats_store.uuid_mapping.add_mapping(vless_uuid, username)
+                logger.info(f"从 add-user 添加映射: {vless_uuid} -> {username}")
         
-        if path == '/node/handler/add-users':
-            # 批量添加用户
-            users = body.get('users', [])
-            for user in users:
-                user_data = user.get('userData', {})
-                user_id = user_data.get('userId')
-                vless_uuid = user_data.get('vlessUuid')
-                
-                if user_id and vless_uuid:
-                    stats_store.uuid_mapping.add_mapping(vless_uuid, user_id)
+        self.send_raw_json(HANDLER_SUCCESS_BODY)
+    
+    def _post_add_users(self, body: dict):
+        # 批量添加用户
+        users = body.get('users', [])
+        for user in users:
+            user_data = user.get('userData', {})
+            user_id = user_data.get('userId')
+            vless_uuid = user_data.get('vlessUuid')
             
-            logger.info(f"从 add-users 添加 {len(users)} 个用户映射")
-            self.send_json({"response": {"success": True, "error": None}})
-            return
-        
-        if path == '/node/handler/remove-user':
-            hash_data = body.get('hashData', {})
-            vless_uuid = hash_data.get('vlessUuid')
-            if vless_uuid:
-                stats_store.uuid_mapping.remove_by_uuid(vless_uuid)
-                logger.info(f"删除映射: {vless_uuid}")
-            self.send_json({"response": {"success": True, "error": None}})
-            return
-        
-        if path == '/node/handler/remove-users':
-            users = body.get('users', [])
-            for user in users:
-                hash_uuid = user.get('hashUuid')
-                if hash_uuid:
-                    stats_store.uuid_mapping.remove_by_uuid(hash_uuid)
-            logger.info(f"批量删除 {len(users)} 个用户映射")
-            self.send_json({"response": {"success": True, "error": None}})
-            return
-        
-        if path == '/node/handler/get-inbound-users':
-            self.send_json({
-                "response": {
-                    "users": []
-                }
-            })
-            return
+            if user_id and vless_uuid:
+                stats_store.uuid_mapping.add_mapping(vless_uuid, user_id)
         
-        if path == '/node/handler/get-inbound-users-count':
-            self.send_json({
-                "response": {
-                    "count": len(stats_store._stats)
-                }
-            })
-            return
-        
-        self.send_error_json("Not Found", 404)
+        logger.info(f"从 add-users 添加 {len(users)} 个用户映射")
+        self.send_raw_json(HANDLER_SUCCESS_BODY)
+    
+    def _post_remove_user(self, body: dict):
+        hash_data = body.get('hashData', {})
+        vless_uuid = hash_data.get('vlessUuid')
+        if vless_uuid:
+            stats_store.uuid_mapping.remove_by_uuid(vless_uuid)
+            logger.info(f"删除映射: {vless_uuid}")
+        self.send_raw_json(HANDLER_SUCCESS_BODY)
+    
+    def _post_remove_users(self, body: dict):
+        users = body.get('users', [])
+        for user in users:
+            hash_uuid = user.get('hashUuid')
+            if hash_uuid:
+                stats_store.uuid_mapping.remove_by_uuid(hash_uuid)
+        logger.info(f"批量删除 {len(users)} 个用户映射")
+        self.send_raw_json(HANDLER_SUCCESS_BODY)
+    
+    def _post_get_inbound_users(self, body: dict):
+        self.send_raw_json(INBOUND_USERS_BODY)
+    
+    def _post_get_inbound_users_count(self, body: dict):
+        self.send_json({
+            "response": {
+                "count": stats_store.user_count
+            }
+        })
+    
+    # 路由表：路径 -> (处理函数, 是否需要 JWT)（字典查找，替代逐个比较路径的 if/elif，
+    # 认证要求随路由一起查出，在分发时统一验证一次）
+    _GET_ROUTES = {
+        '/': (_get_health, False),
+        '/health': (_get_health, False),
+        '/node/stats/get-system-stats': (_get_system_stats, True),
+        '/node/xray/healthcheck': (_get_xray_healthcheck, True),
+        '/node/xray/status': (_get_xray_status, True),
+        '/node/xray/stop': (_get_xray_stop, True),
+        '/stats': (_get_stats, True),
+        '/mappings': (_get_mappings, False),
+    }
+    
+    _POST_ROUTES = {
+        '/worker/report': (_post_worker_report, False),
+        '/worker/batch-report': (_post_worker_batch_report, False),
+        '/worker/add-mapping': (_post_worker_add_mapping, False),
+        '/worker/batch-add-mapping': (_post_worker_batch_add_mapping, False),
+        '/node/xray/start': (_post_xray_start, True),
+        '/node/stats/get-users-stats': (_post_get_users_stats, True),
+        '/node/stats/get-user-online-status': (_post_get_user_online_status, True),
+        '/node/stats/get-inbound-stats': (_post_get_inbound_stats, True),
+        '/node/stats/get-outbound-stats': (_post_get_outbound_stats, True),
+        '/node/stats/get-all-inbounds-stats': (_post_get_all_inbounds_stats, True),
+        '/node/stats/get-all-outbounds-stats': (_post_get_all_outbounds_stats, True),
+        '/node/stats/get-combined-stats': (_post_get_combined_stats, True),
+        '/node/handler/add-user': (_post_add_user, True),
+        '/node/handler/add-users': (_post_add_users, True),
+        '/node/handler/remove-user': (_post_remove_user, True),
+        '/node/handler/remove-users': (_post_remove_users, True),
+        '/node/handler/get-inbound-users': (_post_get_inbound_users, True),
+        '/node/handler/get-inbound-users-count': (_post_get_inbound_users_count, True),
+    }
+
+
+class NodeHTTPServer(ThreadingHTTPServer):
+    """多线程 HTTP 服务器（线程池 + 按需新建线程）
+
+    accept 循环把连接交给空闲的工作线程复用处理，mTLS 握手和请求处理可以并行进行，
+    通常也不必为每个连接创建线程。所有工作线程都在忙（例如被空闲的 keep-alive 连接占住）时，
+    退回 ThreadingMixIn 的做法为这个连接新建线程，不让新连接排队等待。
+    """
+    allow_reuse_address = True
+    request_queue_size = 128  # listen backlog，默认 5 在并发上报时容易被打满
+    # 常驻工作线程数；超出部分按需新建（ThreadingHTTPServer 的线程均为守护线程）
+    pool_size = 64
+    # 连接的收发缓冲区大小（与解压读缓冲区相当），大批量上报和 /stats 大响应少等待窗口
+    socket_buffer_size = 256 * 1024
+
+    def server_bind(self):
+        """在 listen 之前设置缓冲区大小，accept 得到的连接继承该设置（接收窗口扩大因子在握手时协商）"""
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.socket_buffer_size)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_buffer_size)
+        super().server_bind()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending: queue.SimpleQueue = queue.SimpleQueue()
+        # 空闲的工作线程数：只在确定有线程空闲时才入队，入队的连接不会等待
+        self._idle_workers = self.pool_size
+        self._idle_lock = threading.Lock()
+        for i in range(self.pool_size):
+            # 守护线程：退出时不必等待仍保持着的 keep-alive 连接
+            thread = threading.Thread(target=self._worker_loop, name=f"http-worker-{i}", daemon=True)
+            thread.start()
+
+    def process_request(self, request, client_address):
+        """有空闲工作线程时交给线程池，否则为这个连接新建线程"""
+        with self._idle_lock:
+            pooled = self._idle_workers > 0
+            if pooled:
+                self._idle_workers -= 1
+        if pooled:
+            self._pending.put((request, client_address))
+        else:
+            super().process_request(request, client_address)
+
+    def _worker_loop(self):
+        while True:
+            request, client_address = self._pending.get()
+            # 负责处理请求、异常记录和关闭连接
+            self.process_request_thread(request, client_address)
+            with self._idle_lock:
+                self._idle_workers += 1
 
 
 # ============================================================================
@@ -1046,48 +2179,55 @@ def parse_secret_key(secret_key: str) -> dict:
         raise
 
 
+def load_jwt_public_key(pem: str) -> Optional[object]:
+    """把 PEM 公钥预解析为 cryptography 公钥对象
+    
+    jwt.decode 收到 PEM 字符串时每次验签都要重新解析，传入解析好的对象可以跳过这一步。
+    解析失败时返回原字符串，由 jwt.decode 报告具体错误。
+    """
+    if not pem:
+        return None
+    if not HAS_JWT:
+        return pem
+    try:
+        from cryptography.hazmat.primitives.serialization import load_pem_public_key
+        return load_pem_public_key(pem.encode())
+    except Exception as e:
+        logger.warning(f"JWT 公钥预解析失败，将在验证时解析: {e}")
+        return pem
+
+
 def create_ssl_context(certs: dict, mtls: bool = True) -> ssl.SSLContext:
     """创建 SSL 上下文"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
     
-    # 创建临时文件存储证书
-    cert_file = tempfile.NamedTemporaryFile(mode='w', suffix='.pem', delete=False)
-    key_file = tempfile.NamedTemporaryFile(mode='w', suffix='.pem', delete=False)
-    ca_file = tempfile.NamedTemporaryFile(mode='w', suffix='.pem', delete=False)
+    # load_cert_chain 只接受文件路径：证书和私钥合并写入一个 PEM，
+    # 放在仅当前用户可访问的临时目录中，加载完成后立即随目录一起删除
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        chain_file = os.path.join(tmp_dir, 'node.pem')
+        with open(chain_file, 'w') as f:
+            f.write(certs['nodeCertPem'].rstrip('\n') + '\n' + certs['nodeKeyPem'])
+        context.load_cert_chain(chain_file)
     
-    try:
-        cert_file.write(certs['nodeCertPem'])
-        cert_file.close()
-        
-        key_file.write(certs['nodeKeyPem'])
-        key_file.close()
-        
-        ca_file.write(certs['caCertPem'])
-        ca_file.close()
-        
-        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-        context.load_cert_chain(cert_file.name, key_file.name)
-        
-        if mtls:
-            # mTLS: 要求客户端证书
-            context.load_verify_locations(ca_file.name)
-            context.verify_mode = ssl.CERT_REQUIRED
-            logger.info("启用 mTLS 认证")
-        else:
-            context.verify_mode = ssl.CERT_NONE
-            logger.info("禁用 mTLS（仅 HTTPS）")
-        
-        return context
-    finally:
-        # 延迟删除临时文件
-        def cleanup():
-            time.sleep(1)
-            for f in [cert_file.name, key_file.name, ca_file.name]:
-                try:
-                    os.unlink(f)
-                except:
-                    pass
-        
-        threading.Thread(target=cleanup, daemon=True).start()
+    # 整个进程共用这一个上下文，握手开销集中在这里调优：
+    # - 仅 TLS 1.2+，TLS 1.2 只用 ECDHE + AEAD 套件（走 AES-NI/GCM 或 ChaCha20 硬件友好路径）
+    # - 保持会话票据开启，重连的客户端可以恢复会话，跳过完整握手和证书链校验
+    # - 禁止重协商，避免客户端在已建立的连接上反复触发握手
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers('ECDHE+AESGCM:ECDHE+CHACHA20')
+    context.options &= ~ssl.OP_NO_TICKET
+    context.options |= ssl.OP_NO_RENEGOTIATION
+    
+    if mtls:
+        # mTLS: 要求客户端证书（CA 证书直接从内存加载）
+        context.load_verify_locations(cadata=certs['caCertPem'])
+        context.verify_mode = ssl.CERT_REQUIRED
+        logger.info("启用 mTLS 认证")
+    else:
+        context.verify_mode = ssl.CERT_NONE
+        logger.info("禁用 mTLS（仅 HTTPS）")
+    
+    return context
 
 
 # ============================================================================
@@ -1114,31 +2254,35 @@ def main():
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
     
-    # 初始化统计存储（支持持久化）
-    init_stats_store(args.data_file)
+    # 初始化统计存储（支持持久化）；数据文件无法读取时不启动，避免覆盖原有数据
+    try:
+        init_stats_store(args.data_file)
+    except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(1)
     
     # 创建服务器
-    server = HTTPServer(('0.0.0.0', args.port), NodeHandler)
+    server = NodeHTTPServer(('0.0.0.0', args.port), NodeHandler)
     
     # 配置认证
     if args.no_auth:
-        NodeHandler.no_auth = True
-        NodeHandler.jwt_public_key = None
+        NodeHandler.configure_auth(None)
         protocol = "HTTP"
     elif args.secret_key:
         certs = parse_secret_key(args.secret_key)
         
-        # 设置 JWT 公钥
-        NodeHandler.jwt_public_key = certs['jwtPublicKey']
-        NodeHandler.no_auth = False
+        # 设置 JWT 公钥（启动时解析一次）
+        NodeHandler.configure_auth(load_jwt_public_key(certs['jwtPublicKey']))
         
         # 配置 HTTPS
         ssl_context = create_ssl_context(certs, mtls=not args.no_mtls)
-        server.socket = ssl_context.wrap_socket(server.socket, server_side=True)
+        # 握手延迟到处理线程中进行（见 NodeHandler.handle），不阻塞 accept 循环
+        server.socket = ssl_context.wrap_socket(server.socket, server_side=True,
+                                                do_handshake_on_connect=False)
         protocol = "HTTPS" + (" + mTLS" if not args.no_mtls else "")
     else:
         logger.warning("未提供 SECRET_KEY，使用 HTTP 模式（不推荐）")
-        NodeHandler.no_auth = True
+        NodeHandler.configure_auth(None)
         protocol = "HTTP"
     
     logger.info("=" * 70)
@@ -0,0 +1,83 @@
+"""mock_node.py 的回归测试
+
+运行: python -m unittest discover -s scripts
+"""
+
+import json
+import logging
+import os
+import tempfile
+import unittest
+
+import mock_node
+from mock_node import INT64_MAX, StatsStore
+
+logging.disable(logging.CRITICAL)
+
+
+class TrafficOverflowTest(unittest.TestCase):
+    """流量累计超出 int64 时整条上报被丢弃，用户统计和出入站统计保持一致"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.data_file = os.path.join(self._tmp.name, 'stats.json')
+        self.store = StatsStore(self.data_file)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def user_totals(self) -> dict:
+        users = json.loads(self.store.get_users_stats_body())['response']['users']
+        return {u['username']: (u['uplink'], u['downlink']) for u in users}
+
+    def tag_totals(self) -> tuple[dict, dict]:
+        combined = json.loads(self.store.get_combined_stats_body())['response']
+        return ({s['inbound']: (s['uplink'], s['downlink']) for s in combined['inbounds']},
+                {s['outbound']: (s['uplink'], s['downlink']) for s in combined['outbounds']})
+
+    def test_user_overflow_skips_tag_deltas(self):
+        self.store.report_batch([('a', INT64_MAX, 0, 'IN', 'OUT')])
+        self.store.get_combined_stats_body(reset=True)
+        # 'a' 的累计会溢出，整条丢弃；标签累计不会溢出，但也不能计入 'a' 的这 1 字节
+        self.store.report_batch([('a', 1, 0, 'IN2', 'OUT2'), ('b', 5, 5, 'IN2', 'OUT2')])
+
+        self.assertEqual(self.user_totals(), {'a': (INT64_MAX, 0), 'b': (5, 5)})
+        inbounds, outbounds = self.tag_totals()
+        self.assertEqual(inbounds, {'IN2': (5, 5)})
+        self.assertEqual(outbounds, {'OUT2': (5, 5)})
+
+    def test_tag_overflow_across_users(self):
+        self.store.report_batch([(f'u{i}', INT64_MAX, 0, 'VLESS_WS', 'DIRECT') for i in range(3)])
+
+        users = self.user_totals()
+        inbounds, outbounds = self.tag_totals()
+        # 只有第一条能写入，标签累计与用户累计一致且不超出 int64
+        self.assertEqual(users, {'u0': (INT64_MAX, 0)})
+        self.assertEqual(inbounds, {'VLESS_WS': (INT64_MAX, 0)})
+        self.assertEqual(outbounds, {'DIRECT': (INT64_MAX, 0)})
+        self.store.get_combined_stats_body()
+
+        # 快照仍然可以写入，旧的增量日志随之删除
+        self.store.save_now()
+        self.assertTrue(os.path.exists(self.data_file))
+        logs = [name for name in os.listdir(self._tmp.name) if '.log.' in name]
+        self.assertEqual(len(logs), 1)
+        self.assertEqual(StatsStore(self.data_file).get_user_totals(), (INT64_MAX, 0))
+
+    def test_queued_reports_survive_overflow(self):
+        for i in range(3):
+            self.store.report(f'u{i}', INT64_MAX, 0, 'VLESS_WS', 'DIRECT')
+        self.store.report('ok', 1, 1, 'OTHER', 'OTHER')
+
+        users = self.user_totals()
+        self.assertEqual(users['ok'], (1, 1))
+        self.assertEqual(sum(up for up, _ in users.values()), INT64_MAX + 1)
+
+    def test_parse_traffic_rejects_out_of_range(self):
+        self.assertEqual(mock_node.parse_traffic('12'), 12)
+        with self.assertRaises(ValueError):
+            mock_node.parse_traffic(1 << 64)
+
+
+if __name__ == '__main__':
+    unittest.main()